@@ -1,125 +1,133 @@
 # -*- coding: utf-8 -*-
 import time
-import random
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import database as db
 import ticket_core 
+from scheduler import TaskScheduler
+from poll_policy import PollPolicy
+from route_leases import create_leases
+from migrations import init_db
+import metrics
+from logutil import log
 
 # ================= 配置区 =================
-BATCH_INTERVAL = 15  # 心跳间隔缩短为 15秒 (用于快速发现新任务)
-TASK_POLL_INTERVAL = 60 * 10  # 单个任务轮询间隔 (10分钟)
-MAX_WORKERS = 3
+BATCH_INTERVAL = 15  # 最长休眠 15秒 (增量同步，用于快速发现新任务)
+MAX_WORKERS = 3  # 并发执行的线路组数 (请求间隔由全局节拍器统一控制)
 
-def log(msg):
-    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}", flush=True)
+def route_kind(route_key):
+    """指标标签：有中转站的是 transfer，否则 direct"""
+    return "transfer" if route_key[3] else "direct"
+
+def update_backlog_metrics(scheduler, running):
+    metrics.DUE_BACKLOG.set(sum(len(task_list) for _, task_list in running.values()) + scheduler.due_backlog())
+    metrics.SCHEDULED_TASKS.set(len(scheduler))
+
+def release_leases(leases, route_keys):
+    """本轮结束的线路一次归还；失败只记录日志，租约到期后自然释放"""
+    try:
+        leases.release(route_keys)
+    except Exception as e:
+        log(f"⚠️ 归还线路租约失败: {e}")
 
 def process_route_group(route_key, task_list):
-    """Worker 调用的处理函数"""
+    """Worker 调用的处理函数 (在线程池中执行)，返回本次是否真正执行了查询"""
     f_st, t_st, date, m_st = route_key
     
-    # 随机延迟防止并发瞬间撞墙
-    time.sleep(random.uniform(1.0, 5.0))
-    
-    # 执行查询
-    if m_st:
-        success, count = ticket_core.query_transfer_and_notify(f_st, m_st, t_st, date, task_list)
-    else:
-        success, count = ticket_core.query_and_notify(f_st, t_st, date, task_list)
+    # 执行查询 (请求间隔由 ticket_core 内的全局节拍器控制，这里不再各自 sleep)
+    with metrics.ROUTE_GROUP_SECONDS.time(kind=route_kind(route_key)):
+        if m_st:
+            success, count = ticket_core.query_transfer_and_notify(f_st, m_st, t_st, date, task_list)
+        else:
+            success, count = ticket_core.query_and_notify(f_st, t_st, date, task_list)
     
     # 无论成功与否，只要尝试过查询，就更新检查时间
-    # 这样可以防止任务被无限重试，符合 TASK_POLL_INTERVAL 限制
-    if success: # 如果因限流失败(success=False)，则不更新时间，以便下轮重试(受限流锁控制)
-        for task in task_list:
-            db.update_check_time(task[0])
+    # 这样可以防止任务被无限重试，下次检查时间由 poll_policy 分配的线路间隔决定
+    if success: # 如果因限流或查询失败(success=False)，则不更新时间，以便下轮重试(受限流锁控制)
+        db.update_check_time_many([task.id for task in task_list])
         log(f"✅ 已更新 {len(task_list)} 个任务的检查时间")
 
     if not success:
-        log(f"⚠️ 线路 {f_st}->{t_st} 因限流未执行")
-
-def worker_loop():
-    log("🚀 后台监控服务已启动 (智能轮询版)...")
-    db.init_db()
-    
-    while True:
-        try:
-            all_tasks = db.get_active_tasks()
-        except Exception as e:
-            log(f"❌ DB错误: {e}")
-            time.sleep(5)
-            continue
-        
-        if not all_tasks:
-            # 即使没任务也只睡短一点，防止刚加任务要等很久
-            time.sleep(10)
-            continue
-        
-        # 1. 筛选需要执行的任务
-        tasks_to_process = []
-        current_time = datetime.now()
-        
-        for task in all_tasks:
-            t_id = task[0]
-            # 解析 last_check_time (假设第11个字段是 created, 12是last_check... 需兼容)
-            # 最好直接根据结构取。
-            # 结构: id(0), user(1), f(2), t(3), date(4), tt(5), st(6), email(7), status(8), 
-            #       created(9), last_check(10), last_notify(11), middle(12)
-            
-            last_check = task[10]
-            last_notify = task[11]
+        log(f"⚠️ 线路 {f_st}->{t_st} 因限流或查询失败未执行")
+    return success
 
-            # --- 检查1: 是否有票刚通知过 (3小时冷却) ---
-            if last_notify:
-                if isinstance(last_notify, str):
-                    try: last_notify = datetime.strptime(last_notify, "%Y-%m-%d %H:%M:%S")
-                    except: pass
-                if isinstance(last_notify, datetime):
-                    if current_time - last_notify < timedelta(hours=3):
-                        # 冷却中，直接跳过
-                        continue
+def worker_loop(stop_event=None):
+    """后台主循环；stop_event 被设置后不再派发新线路，等执行中的线路结束后返回 (仿真/测试用)"""
+    log(f"🚀 后台监控服务已启动 (智能轮询版, {MAX_WORKERS} 线程)...")
+    init_db()
+    metrics.start_http_server()
+    policy = PollPolicy()
+    # 线路租约 (多 Worker 时开启)：可同时运行多个 Worker (同机或多机)，每条线路同一时刻只有一个 Worker 在查
+    leases = create_leases()
+    scheduler = TaskScheduler(policy, leases)
+    log(f"📊 轮询预算: {policy.budget * 60:.2f} 次/分钟"
+        + (f" (线路租约已开启，Worker 标识 {leases.owner})" if leases else ""))
+    running = {}  # future -> (route_key, task_list)
 
-            # --- 检查2: 是否刚查过 (10分钟轮询间隔) ---
-            # 如果 last_check 为 None，说明是新任务，立即执行
-            should_run = True
-            if last_check:
-                if isinstance(last_check, str):
-                    try: last_check = datetime.strptime(last_check, "%Y-%m-%d %H:%M:%S")
-                    except: pass
-                if isinstance(last_check, datetime):
-                    if current_time - last_check < timedelta(seconds=TASK_POLL_INTERVAL):
-                        should_run = False
-            
-            if should_run:
-                tasks_to_process.append(task)
-        
-        if not tasks_to_process:
-            # 没有需要跑的任务，安静休眠
-            # log(f"💤 暂无待办任务，待机中...") 
-            time.sleep(BATCH_INTERVAL)
-            continue
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        while not (stop_event and stop_event.is_set()):
+            metrics.WORKER_TICKS.inc()
+            # 1. 增量同步 + 取出已到期的线路 (到期判断由调度器的小顶堆完成，无需全表扫描)
+            try:
+                if leases:
+                    leases.renew()
+                    hosts = leases.heartbeat()
+                    if hosts and policy.set_hosts(hosts):
+                        # 紧接着的 sync 会按新预算重新分配各线路的间隔
+                        log(f"📊 在线主机 {hosts} 台，轮询预算调整为 {policy.budget * 60:.2f} 次/分钟")
+                    leases.prune()
+                scheduler.sync()
+                # 只取空闲槽位数的线路 (多 Worker 时其余到期线路的租约留给别的 Worker 去领)
+                free = MAX_WORKERS - len(running)
+                grouped_tasks = scheduler.pop_due(free) if free > 0 else {}
+                # 槽位已满时不必按到期时间醒来，等执行中的线路完成即可
+                max_wait = scheduler.seconds_until_next(BATCH_INTERVAL) \
+                    if len(running) + len(grouped_tasks) < MAX_WORKERS else BATCH_INTERVAL
+            except Exception as e:
+                log(f"❌ DB错误: {e}")
+                grouped_tasks, max_wait = {}, 5
 
-        log(f"⚡ 发现 {len(tasks_to_process)} 个待执行任务...")
+            # 2. 提交到线程池并发执行 (调度器已将其标记为执行中，不会重复弹出)
+            if grouped_tasks:
+                log(f"⚡ 发现 {sum(len(v) for v in grouped_tasks.values())} 个待执行任务 "
+                    f"(当前轮询预计 {policy.expected_rate():.2f} 次/分钟)...")
+            for r_key, task_list in grouped_tasks.items():
+                running[executor.submit(process_route_group, r_key, task_list)] = (r_key, task_list)
+            update_backlog_metrics(scheduler, running)
 
-        # 2. 分组
-        grouped_tasks = {}
-        for task in tasks_to_process:
-            # task[12] 是 middle_station
-            m_st = task[12] if len(task) > 12 else None
-            key = (task[2], task[3], task[4], m_st) 
-            if key not in grouped_tasks: grouped_tasks[key] = []
-            grouped_tasks[key].append(task)
+            if not running:
+                # 没有到期的线路：睡到下一个截止时间 (最多 BATCH_INTERVAL，以便及时发现新任务)
+                if stop_event:
+                    stop_event.wait(max_wait)
+                else:
+                    time.sleep(max_wait)
+                continue
 
-        # 3. 执行
-        route_keys = list(grouped_tasks.keys())
-        for i, r_key in enumerate(route_keys):
-            process_route_group(r_key, grouped_tasks[r_key])
-            
-            # 任务间稍微间隔，防止瞬间并发
-            if i < len(route_keys) - 1:
-                time.sleep(random.uniform(5, 10))
+            # 3. 等到有线路完成或下一个截止时间到达，回收结果 (调度器只在主线程里操作)
+            #    执行中的线路需要按时心跳，等待不超过租约有效期的 1/3
+            timeout = min(max_wait, leases.ttl / 3) if leases else max_wait
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            finished = []
+            for future in done:
+                r_key, task_list = running.pop(future)
+                try:
+                    success = future.result()
+                except Exception as e:
+                    log(f"❌ 线路 {r_key[0]}->{r_key[1]} 执行异常: {e}")
+                    success = False
+                if success:
+                    metrics.TASKS_CHECKED.inc(len(task_list), kind=route_kind(r_key))
+                    scheduler.finish(r_key, [task.id for task in task_list])
+                else:
+                    metrics.ROUTE_GROUP_FAILURES.inc(kind=route_kind(r_key))
+                    scheduler.finish(r_key, retry_after=BATCH_INTERVAL)
+                finished.append(r_key)
+            if leases:
+                release_leases(leases, finished)
+            update_backlog_metrics(scheduler, running)
 
-        log(f"✅ 本轮执行完毕，休眠 {BATCH_INTERVAL} 秒...\n")
-        time.sleep(BATCH_INTERVAL)
+    # 停止时归还仍持有的租约，其它 Worker 无需等到过期
+    if leases:
+        release_leases(leases, leases.held())
 
 if __name__ == "__main__":
     worker_loop()
\ No newline at end of file
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+基准测试用的 leftTicket/query 结果数据
+- 优先读取 benchmarks/fixtures/ 下录制好的 JSON (已脱敏)
+- 没有时用固定种子的合成数据 (格式与真实结果一致，跨提交可重复)
+
+录制真实数据 (需要能访问 12306)：
+    python benchmarks/fixtures.py record --from BJP --to SHH --date 2026-02-01 --name direct_100
+重新生成合成数据：
+    python benchmarks/fixtures.py synth
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from train_record import SEAT_COLUMNS
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+SIZES = (20, 100, 300)
+ROW_COLUMNS = 38  # 真实结果每行约 37~40 列
+# 含会话/订单信息的列，录制时清空：0=secretStr, 12=yp_info, 35 之后为加密的票价/折扣串
+SENSITIVE_COLUMNS = (0, 12, 35, 36, 37)
+
+_PREFIXES = ("G", "G", "G", "D", "D", "C", "Z", "T", "K", "K", "")
+_COUNTS = ("", "", "无", "无", "有", "有", "1", "3", "5", "8", "12", "19", "20", "*")
+
+
+def synth_rows(count, seed, from_code="AAA", to_code="BBB"):
+    """合成 count 行结果：车次号、发到时间、各席别余票按种子随机，列数与真实结果一致"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        prefix = rng.choice(_PREFIXES)
+        code = f"{prefix}{rng.randint(1, 9999)}"
+        depart = rng.randint(0, 24 * 60 - 1)
+        duration = rng.randint(40, 18 * 60)
+        arrive = (depart + duration) % (24 * 60)
+        parts = [""] * ROW_COLUMNS
+        parts[1] = "预订"
+        parts[2] = f"{i:012d}"
+        parts[3] = code
+        parts[4], parts[5], parts[6], parts[7] = from_code, to_code, from_code, to_code
+        parts[8] = f"{depart // 60:02d}:{depart % 60:02d}"
+        parts[9] = f"{arrive // 60:02d}:{arrive % 60:02d}"
+        parts[10] = f"{duration // 60:02d}:{duration % 60:02d}"
+        parts[11] = "Y"
+        parts[13] = "20260201"
+        for _, col in SEAT_COLUMNS:
+            parts[col] = rng.choice(_COUNTS)
+        rows.append("|".join(parts))
+    return rows
+
+
+def anonymize(rows):
+    """清空录制结果里的会话与订单相关列，其余 (车次、时间、余票) 保持原样"""
+    result = []
+    for row in rows:
+        parts = row.split("|")
+        for col in SENSITIVE_COLUMNS:
+            if col < len(parts):
+                parts[col] = ""
+        result.append("|".join(parts))
+    return result
+
+
+def fixture_path(name):
+    return os.path.join(FIXTURE_DIR, f"{name}.json")
+
+
+def save_fixture(name, rows, source):
+    os.makedirs(FIXTURE_DIR, exist_ok=True)
+    with open(fixture_path(name), "w", encoding="utf-8") as f:
+        json.dump({"source": source, "result": rows}, f, ensure_ascii=False, indent=0)
+
+
+def load_rows(name, count, seed):
+    """读取录制好的数据，没有则按种子合成"""
+    try:
+        with open(fixture_path(name), encoding="utf-8") as f:
+            return json.load(f)["result"]
+    except (OSError, ValueError, KeyError):
+        return synth_rows(count, seed)
+
+
+def direct_rows(size):
+    """直达线路的一次查询结果"""
+    return load_rows(f"direct_{size}", size, seed=size)
+
+
+def transfer_rows(size):
+    """中转线路两程的查询结果 (第一程, 第二程)"""
+    return (load_rows(f"transfer1_{size}", size, seed=size * 10 + 1),
+            load_rows(f"transfer2_{size}", size, seed=size * 10 + 2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="录制或生成基准测试数据")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    rec = sub.add_parser("record", help="从 12306 录制一次查询结果并脱敏保存")
+    rec.add_argument("--from", dest="f_st", required=True, help="出发站电报码")
+    rec.add_argument("--to", dest="t_st", required=True, help="到达站电报码")
+    rec.add_argument("--date", required=True, help="出发日期 YYYY-MM-DD")
+    rec.add_argument("--name", required=True, help="保存名，如 direct_100 / transfer1_100")
+
+    sub.add_parser("synth", help="按固定种子重新生成全部合成数据")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        import ticket_core  # 需要完整的运行环境 (网络、依赖)
+        rows = ticket_core._request_trains(args.f_st, args.t_st, args.date)
+        if rows is None:
+            sys.exit("❌ 查询失败")
+        save_fixture(args.name, anonymize(rows), f"recorded {args.f_st}->{args.t_st} {args.date}")
+        print(f"✅ 已保存 {len(rows)} 行: {fixture_path(args.name)}")
+    else:
+        for size in SIZES:
+            save_fixture(f"direct_{size}", synth_rows(size, seed=size), f"synthetic seed={size}")
+            save_fixture(f"transfer1_{size}", synth_rows(size, seed=size * 10 + 1), f"synthetic seed={size * 10 + 1}")
+            save_fixture(f"transfer2_{size}", synth_rows(size, seed=size * 10 + 2), f"synthetic seed={size * 10 + 2}")
+        print(f"✅ 已生成合成数据: {FIXTURE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+离线微基准：解析、席别匹配、中转配对、邮件渲染
+每条线路 20 / 100 / 300 个车次 × 1 / 100 / 1000 个订阅者，结果输出为 JSON，便于跨提交对比
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json   # 与上次结果对比
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from fixtures import ROOT, SIZES, direct_rows, transfer_rows
+
+from train_record import TrainRecord
+from train_filter import TrainFilter, RouteFilter, TRAIN_TYPE_OPTIONS
+from seat_index import SeatIndex
+from transfer_matcher import TransferMatcher
+from change_detector import encode_entries, seat_entries
+from email_templates import generate_email_html
+
+SUBSCRIBERS = (1, 100, 1000)
+_SEAT_CHOICES = ("二等", "一等", "商务", "硬卧", "软卧", "硬座", "无座")
+_WINDOWS = (None, None, None, "06:00-12:00", "08:00-20:00", "18:00-06:00")
+
+
+def make_subscribers(count, seed=7):
+    """合成订阅者：多数用默认偏好 (与真实分布类似，大量任务共享同一筛选签名)，少数指定时间段/车次"""
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(count):
+        if rng.random() < 0.6:
+            seats, types, windows = ["二等", "硬卧"], list(TRAIN_TYPE_OPTIONS), (None, None)
+        else:
+            seats = rng.sample(_SEAT_CHOICES, rng.randint(1, 3))
+            types = rng.sample(TRAIN_TYPE_OPTIONS, rng.randint(1, 3))
+            windows = (rng.choice(_WINDOWS), rng.choice(_WINDOWS))
+        codes = f"G{rng.randint(1, 9999)},D{rng.randint(1, 9999)}" if rng.random() < 0.05 else None
+        tasks.append(SimpleNamespace(
+            id=i, seat_types=",".join(seats), train_types=",".join(types), train_codes=codes,
+            depart_window=windows[0], arrive_window=windows[1]))
+    return tasks
+
+
+def measure(fn, repeat=5, min_time=0.05):
+    """自适应循环次数，重复 repeat 轮，返回单次调用耗时 (秒) 的 [最小值, 中位数]"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return min(samples), statistics.median(samples)
+
+
+# ================= 基准用例 =================
+# 每个用例返回一个无参函数，模拟一次查询后 ticket_core 对整组订阅者做的工作
+
+def case_parse(size, tasks):
+    rows = direct_rows(size)
+    route_filter = RouteFilter(TrainFilter.from_task(task) for task in tasks)
+    return lambda: [TrainRecord.parse(row, route_filter) for row in rows]
+
+
+def case_seat_match(size, tasks):
+    trains = [t for t in (TrainRecord.parse(row) for row in direct_rows(size)) if t]
+    filters = [(task.seat_types.split(','), TrainFilter.from_task(task)) for task in tasks]
+
+    def run():
+        # 与 query_and_notify 一致：筛选签名相同的订阅者共用匹配结果与余票条目
+        index = SeatIndex(trains)
+        matched = {}
+        for seats, task_filter in filters:
+            key = (tuple(seats), task_filter.key)
+            if key not in matched:
+                hits = index.match(seats, task_filter)
+                matched[key] = encode_entries([e for train, seat_list in hits for e in seat_entries(train.code, seat_list)])
+    return run
+
+
+def case_transfer_match(size, tasks):
+    rows_1, rows_2 = transfer_rows(size)
+    trains_1 = [t for t in (TrainRecord.parse(row) for row in rows_1) if t]
+    trains_2 = [t for t in (TrainRecord.parse(row) for row in rows_2) if t]
+    filters = [(task.seat_types.split(','), TrainFilter.from_task(task, leg=1), TrainFilter.from_task(task, leg=2))
+               for task in tasks]
+
+    def run():
+        matcher = TransferMatcher(trains_1, trains_2)
+        for seats, filter_1, filter_2 in filters:
+            plans = matcher.match(seats, 5, filter_1, filter_2)
+            encode_entries([e for t1, t2, _, seats_1, seats_2 in plans
+                            for e in seat_entries((t1.code, t2.code, 1), seats_1) + seat_entries((t1.code, t2.code, 2), seats_2)])
+    return run
+
+
+def case_render(size, tasks):
+    trains = [t for t in (TrainRecord.parse(row) for row in direct_rows(size)) if t]
+    filters = [(task.seat_types.split(','), TrainFilter.from_task(task)) for task in tasks]
+
+    def run():
+        # 与 query_and_notify 一致：筛选签名相同的订阅者共用渲染结果
+        index = SeatIndex(trains)
+        rendered = {}
+        for seats, task_filter in filters:
+            key = (tuple(seats), task_filter.key)
+            if key not in rendered:
+                found = [f"<b>{train.code}</b> {train.start}-{train.end} ({' '.join(seat_list)})"
+                         for train, seat_list in index.match(seats, task_filter)]
+                tickets_html = "".join([f"<li style='margin-bottom:8px;'>{t}</li>" for t in found])
+                rendered[key] = generate_email_html(tickets_html)
+    return run
+
+
+CASES = {
+    "parse": case_parse,
+    "seat_match": case_seat_match,
+    "transfer_match": case_transfer_match,
+    "render": case_render,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(cases, sizes, subscribers, repeat):
+    results = []
+    for name in cases:
+        for size in sizes:
+            for count in subscribers:
+                entry = {"case": name, "trains": size, "subscribers": count}
+                fn = CASES[name](size, make_subscribers(count))
+                best, median = measure(fn, repeat)
+                entry.update(min_seconds=best, median_seconds=median)
+                results.append(entry)
+                print(f"{name:<15} trains={size:<4} subscribers={count:<5} median={median * 1000:9.3f} ms",
+                      file=sys.stderr)
+    return results
+
+
+def compare(results, baseline_path):
+    """与基线结果对比：ratio = 本次中位数 / 基线中位数 (小于 1 表示变快)"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["case"], r["trains"], r["subscribers"]): r for r in json.load(f)["results"]}
+    for entry in results:
+        old = baseline.get((entry["case"], entry["trains"], entry["subscribers"]))
+        if old and "median_seconds" in old and "median_seconds" in entry:
+            entry["baseline_median_seconds"] = old["median_seconds"]
+            entry["ratio"] = entry["median_seconds"] / old["median_seconds"]
+            print(f"{entry['case']:<15} trains={entry['trains']:<4} subscribers={entry['subscribers']:<5} "
+                  f"x{entry['ratio']:.2f}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="12306 监控热点路径的离线基准")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES))
+    parser.add_argument("--subscribers", nargs="+", type=int, default=list(SUBSCRIBERS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="结果 JSON 写入的文件 (默认输出到 stdout)")
+    parser.add_argument("--baseline", help="用于对比的上次结果 JSON")
+    args = parser.parse_args()
+
+    results = run(args.cases, args.sizes, args.subscribers, args.repeat)
+    if args.baseline:
+        compare(results, args.baseline)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat
+        },
+        "results": results
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+# -*- coding: utf-8 -*-
+"""
+端到端负载仿真：在本机替身环境里运行真实的 worker_loop 与 dispatcher_loop，评估单个 Worker 的承载能力
+- 模拟 12306：leftTicket/init (含 CLeftTicketUrl)、余票查询、station_name.js，按脚本在指定时刻放出余票
+- 一次性数据库：默认为临时目录下的 SQLite 文件，--db mysql 时临时创建 ticket_sim_<pid> 库，结束后删除
+- 本地 SMTP 收件器：记录每封邮件的收件人与到达时间
+
+输出 JSON：吞吐 (任务数/秒、首轮全量检查耗时)、每轮主循环的数据库事务数、余票放出 -> 邮件到达的延迟
+
+    python benchmarks/simulate.py --tasks 10000 --duration 120
+    python benchmarks/simulate.py --tasks 50000 --latency 0.3 --output sim.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from fixtures import synth_rows
+
+from train_record import SEAT_COLUMNS
+
+QUERY_PATH = "leftTicket/queryZ"  # 模拟服务通过 CLeftTicketUrl 下发的查询地址
+SEAT_NAME = "二等"  # 仿真任务订阅的席别，放票时把该列改为 "有"
+_SEAT_COL = dict(SEAT_COLUMNS)[SEAT_NAME]
+
+
+def log(msg):
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}", file=sys.stderr, flush=True)
+
+
+def station_code(n):
+    """第 n 个合成车站的电报码 (3 位大写字母)"""
+    letters = []
+    for _ in range(3):
+        n, r = divmod(n, 26)
+        letters.append(chr(ord("A") + r))
+    return "".join(reversed(letters))
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "min": min(values), "median": statistics.median(values),
+            "p95": percentile(values, 0.95), "max": max(values)}
+
+
+# ================= 模拟 12306 =================
+
+class FakeRailway:
+    """
+    合成线路与放票脚本：route_id 的 (出发, 到达) 由两组车站交叉组成 (车站被多条线路共用，接近真实分布)
+    线路初始全部无票；到达 appear_at[route_id] 时刻后，第一个车次的二等座变为 "有"
+    """
+
+    def __init__(self, routes, trains, events, window, seed=1):
+        self.side = max(1, math.isqrt(routes - 1) + 1)
+        self.routes = routes
+        self.trains = trains
+        self.route_by_pair = {self.pair(i): i for i in range(routes)}
+        rng = random.Random(seed)
+        start, end = window
+        self.appear_at = {route_id: time.time() + rng.uniform(start, end)
+                          for route_id in rng.sample(range(routes), min(events, routes))}
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def pair(self, route_id):
+        return station_code(route_id // self.side), station_code(self.side + route_id % self.side)
+
+    def stations(self):
+        return [station_code(n) for n in range(self.side * 2)]
+
+    def station_js(self):
+        parts = [f"@s{n}|仿真站{n}|{code}|fangzhenzhan{n}|fzz{n}|{n}" for n, code in enumerate(self.stations())]
+        return "var station_names ='" + "".join(parts) + "';"
+
+    def rows(self, f_st, t_st):
+        route_id = self.route_by_pair.get((f_st, t_st))
+        if route_id is None:
+            return []
+        appeared = time.time() >= self.appear_at.get(route_id, float("inf"))
+        key = (route_id, appeared)
+        rows = self._rows.get(key)
+        if rows is None:
+            rows = []
+            for i, row in enumerate(synth_rows(self.trains, seed=route_id, from_code=f_st, to_code=t_st)):
+                parts = row.split("|")
+                for _, col in SEAT_COLUMNS:
+                    parts[col] = "无"
+                if appeared and i == 0:
+                    parts[_SEAT_COL] = "有"
+                rows.append("|".join(parts))
+            with self._lock:
+                self._rows[key] = rows
+        return rows
+
+
+def make_railway_handler(railway, latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive，与真实 12306 一致，会话池才有意义
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path.endswith("/leftTicket/init"):
+                self._send("text/html", f"<script>var CLeftTicketUrl = '{QUERY_PATH}';</script>")
+            elif url.path.endswith("/" + QUERY_PATH):
+                time.sleep(latency)
+                query = parse_qs(url.query)
+                rows = railway.rows(query.get("leftTicketDTO.from_station", [""])[0],
+                                    query.get("leftTicketDTO.to_station", [""])[0])
+                self._send("application/json", json.dumps({"data": {"result": rows, "map": {}}, "status": True}))
+            elif url.path.endswith("/station_name.js"):
+                self._send("application/javascript", railway.station_js())
+            else:
+                self.send_error(404)
+
+        def _send(self, content_type, text):
+            body = text.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# ================= SMTP 收件器 =================
+
+class SmtpSink(socketserver.ThreadingTCPServer):
+    """最小的 SMTP 服务端：接受 AUTH PLAIN 与任意收件人，记录 (收件人, 到达时间)"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr):
+        super().__init__(addr, _SmtpHandler)
+        self.received = []  # (收件人, 到达时间)
+        self.lock = threading.Lock()
+
+    def record(self, recipients):
+        now = time.time()
+        with self.lock:
+            self.received.extend((rcpt, now) for rcpt in recipients)
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, text):
+        self.wfile.write((text + "\r\n").encode("ascii"))
+
+    def handle(self):
+        self.reply("220 sim.local ESMTP")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.reply("250-sim.local")
+                self.reply("250 AUTH PLAIN")
+            elif verb == "HELO":
+                self.reply("250 sim.local")
+            elif verb == "AUTH":
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                match = re.search(r"<([^>]*)>", command)
+                recipients.append(match.group(1) if match else command[8:])
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                self.server.record(recipients)
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RSET":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+# ================= 一次性数据库 =================
+
+def sqlite_path(name):
+    return os.path.join(tempfile.gettempdir(), f"{name}.db")
+
+
+def create_database(kind, name):
+    if kind == "sqlite":
+        return  # 首次连接时自动创建文件
+    import pymysql
+    from database import MYSQL_CONFIG
+    conn = pymysql.connect(host=MYSQL_CONFIG["host"], port=MYSQL_CONFIG["port"],
+                           user=MYSQL_CONFIG["user"], password=MYSQL_CONFIG["password"], charset="utf8mb4")
+    try:
+        with conn.cursor() as c:
+            c.execute(f"CREATE DATABASE `{name}` DEFAULT CHARACTER SET utf8mb4")
+    finally:
+        conn.close()
+
+
+def drop_database(kind, name):
+    if kind == "sqlite":
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(sqlite_path(name) + suffix):
+                os.remove(sqlite_path(name) + suffix)
+        return
+    import pymysql
+    from database import MYSQL_CONFIG
+    conn = pymysql.connect(host=MYSQL_CONFIG["host"], port=MYSQL_CONFIG["port"],
+                           user=MYSQL_CONFIG["user"], password=MYSQL_CONFIG["password"], charset="utf8mb4")
+    try:
+        with conn.cursor() as c:
+            c.execute(f"DROP DATABASE IF EXISTS `{name}`")
+    finally:
+        conn.close()
+
+
+def recipient(route_id, n):
+    return f"r{route_id}-{n}@sim.local"
+
+
+def route_of(email):
+    return int(email.split("-", 1)[0][1:])
+
+
+def insert_tasks(railway, tasks, per_route, travel_date, chunk=2000):
+    """按线路批量插入合成任务：每条线路 per_route 个订阅者，收件人各不相同 (可由收件人反查线路)"""
+    import database as db
+    now = datetime.now()
+    rows = []
+    for i in range(tasks):
+        route_id, n = divmod(i, per_route)
+        f_st, t_st = railway.pair(route_id)
+        rows.append((f"sim{i}", f_st, t_st, travel_date, "", SEAT_NAME, recipient(route_id, n), now))
+    for start in range(0, len(rows), chunk):
+        with db.db_cursor() as c:
+            c.executemany('''INSERT INTO tasks (username, from_station, to_station, date_str, train_types, seat_types,
+                                                receiver_email, created_at, status)
+                             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1)''', rows[start:start + chunk])
+
+
+# ================= 运行 =================
+
+def _run_dispatcher(stop_event, quiet):
+    """发件箱进程入口 (独立进程，数据库事务不计入 Worker 的统计)"""
+    from notification_dispatcher import dispatcher_loop
+    if quiet:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            dispatcher_loop(stop_event)
+    else:
+        dispatcher_loop(stop_event)
+
+
+def configure_env(args, railway_port, smtp_port, db_name, station_path):
+    """在导入项目模块之前设置环境变量 (各模块在导入时读取配置)"""
+    os.environ.update({
+        "TICKET_BASE_URL": f"http://127.0.0.1:{railway_port}/otn/",
+        "DB_BACKEND": args.db,
+        "SQLITE_PATH": sqlite_path(db_name),
+        "MYSQL_DB": db_name,
+        "STATION_INDEX_PATH": station_path,
+        "PACER_MIN_INTERVAL": str(args.pacer),
+        "PACER_JITTER": "0",
+        # 限流放开：仿真测量的是 Worker 自身的处理能力，请求间隔由 --pacer 控制
+        "RATE_LIMIT_BACKEND": "memory",
+        "RATE_LIMIT_PER_MINUTE": "1000000",
+        "RATE_LIMIT_BURST": "1000000",
+        "POLL_BASE_SECONDS": str(args.poll_seconds),
+        "POLL_MIN_SECONDS": str(args.poll_seconds / 4),
+        "POLL_MAX_SECONDS": str(args.poll_seconds * 4),
+        "LEG_CACHE_TTL": str(args.poll_seconds / 8),
+        "SMTP_SERVER": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_USE_SSL": "0",
+        "SMTP_USER": "sim@sim.local",
+        "SMTP_PASSWORD": "sim",
+        "OUTBOX_DIGEST_SECONDS": "0",
+        "OUTBOX_POLL_SECONDS": "0.5",
+        "METRICS_PORT": "0"
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="12306 监控的端到端负载仿真 (模拟 12306 + 临时数据库 + SMTP 收件器)")
+    parser.add_argument("--tasks", type=int, default=1000, help="任务总数 (10 ~ 50000)")
+    parser.add_argument("--subscribers-per-route", type=int, default=5, help="每条线路的订阅任务数")
+    parser.add_argument("--trains", type=int, default=20, help="每条线路的车次数")
+    parser.add_argument("--duration", type=float, default=120, help="Worker 运行秒数")
+    parser.add_argument("--events", type=int, default=20, help="放票事件数 (随机挑选线路)")
+    parser.add_argument("--warmup", type=float, default=None, help="放票开始时间 (默认为运行时长的 1/4)")
+    parser.add_argument("--drain", type=float, default=15, help="Worker 停止后继续等待邮件的秒数")
+    parser.add_argument("--poll-seconds", type=float, default=20, help="权重为 1 的线路的轮询间隔")
+    parser.add_argument("--latency", type=float, default=0.1, help="模拟 12306 的查询响应耗时 (秒)")
+    parser.add_argument("--pacer", type=float, default=0, help="请求节拍器的最小间隔 (秒)，真实环境为 2")
+    parser.add_argument("--db", choices=("sqlite", "mysql"), default="sqlite",
+                        help="临时数据库类型 (mysql 使用 .env 里的 MySQL 服务器)")
+    parser.add_argument("--keep-db", action="store_true", help="结束后保留临时数据库")
+    parser.add_argument("--verbose", action="store_true", help="显示 Worker 与发件箱的日志")
+    parser.add_argument("--output", help="结果 JSON 写入的文件 (默认输出到 stdout)")
+    args = parser.parse_args()
+
+    routes = math.ceil(args.tasks / args.subscribers_per_route)
+    warmup = args.duration / 4 if args.warmup is None else args.warmup
+    # 放票集中在运行期的中段，留出检测时间；之后放出的不计入
+    railway = FakeRailway(routes, args.trains, args.events, (warmup, args.duration * 0.75))
+
+    railway_server = ThreadingHTTPServer(("127.0.0.1", 0), make_railway_handler(railway, args.latency))
+    railway_server.daemon_threads = True
+    threading.Thread(target=railway_server.serve_forever, daemon=True).start()
+    sink = SmtpSink(("127.0.0.1", 0))
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+    db_name = f"ticket_sim_{os.getpid()}"
+    station_path = os.path.join(tempfile.gettempdir(), f"ticket_sim_stations_{os.getpid()}.json")
+    configure_env(args, railway_server.server_address[1], sink.server_address[1], db_name, station_path)
+
+    import metrics
+    from migrations import migrate
+    from backend_worker import worker_loop
+
+    log(f"🗄️ 创建临时数据库 {db_name} ({args.db})，写入 {args.tasks} 个任务 ({routes} 条线路)")
+    create_database(args.db, db_name)
+    stop_worker = threading.Event()
+    ctx = multiprocessing.get_context("spawn")
+    stop_dispatcher = ctx.Event()
+    dispatcher = None
+    try:
+        with redirect_stdout(sys.stderr):  # 迁移的提示不混进 stdout 上的 JSON 结果
+            migrate()
+        travel_date = (date.today() + timedelta(days=1)).strftime("%Y-%m-%d")
+        insert_tasks(railway, args.tasks, args.subscribers_per_route, travel_date)
+
+        dispatcher = ctx.Process(target=_run_dispatcher, args=(stop_dispatcher, not args.verbose), daemon=True)
+        dispatcher.start()
+
+        base_tx = metrics.DB_TRANSACTIONS.total()
+        started = time.time()
+        out = sys.stdout if args.verbose else open(os.devnull, "w")
+        with redirect_stdout(out):
+            worker = threading.Thread(target=worker_loop, args=(stop_worker,), daemon=True)
+            worker.start()
+            sweep_seconds = None
+            while time.time() - started < args.duration:
+                time.sleep(0.5)
+                if sweep_seconds is None and metrics.TASKS_CHECKED.total() >= args.tasks:
+                    sweep_seconds = time.time() - started
+            stop_worker.set()
+            worker.join()
+        if out is not sys.stdout:
+            out.close()
+        elapsed = time.time() - started
+        ticks = metrics.WORKER_TICKS.total()
+        transactions = metrics.DB_TRANSACTIONS.total() - base_tx
+        checked = metrics.TASKS_CHECKED.total()
+        groups = metrics.ROUTE_GROUP_SECONDS.total()
+
+        log(f"⏳ Worker 已停止，等待发件箱发送剩余邮件 ({args.drain:.0f} 秒)")
+        time.sleep(args.drain)
+    finally:
+        stop_dispatcher.set()
+        if dispatcher is not None:
+            dispatcher.join(timeout=30)
+        if not args.keep_db:
+            drop_database(args.db, db_name)
+        if os.path.exists(station_path):
+            os.remove(station_path)
+        railway_server.shutdown()
+        sink.shutdown()
+
+    # 每条放票线路：第一封 / 最后一封邮件的到达延迟
+    arrivals = {}
+    for email, at in sink.received:
+        arrivals.setdefault(route_of(email), []).append(at)
+    first_delays, last_delays, missed = [], [], 0
+    for route_id, appear_at in railway.appear_at.items():
+        times = [at for at in arrivals.get(route_id, []) if at >= appear_at]
+        if not times:
+            missed += 1
+            continue
+        first_delays.append(min(times) - appear_at)
+        last_delays.append(max(times) - appear_at)
+    spurious = sum(1 for email, _ in sink.received if route_of(email) not in railway.appear_at)
+
+    report = {
+        "config": {
+            "tasks": args.tasks, "routes": routes, "subscribers_per_route": args.subscribers_per_route,
+            "trains_per_route": args.trains, "duration": args.duration, "poll_seconds": args.poll_seconds,
+            "latency": args.latency, "pacer": args.pacer, "events": len(railway.appear_at), "db": args.db
+        },
+        "throughput": {
+            "elapsed_seconds": elapsed,
+            "tasks_checked": checked,
+            "tasks_checked_per_second": checked / elapsed,
+            "route_groups_per_second": groups / elapsed,
+            # 新任务的检查时间为空，启动后全部立即到期：首轮检查完全部任务的耗时就是一次全量轮询所需时间
+            "first_sweep_seconds": sweep_seconds,
+            "route_group_failures": metrics.ROUTE_GROUP_FAILURES.total(),
+            "fetch_errors": metrics.FETCH_ERRORS.total()
+        },
+        "database": {
+            "worker_ticks": ticks,
+            "transactions": transactions,
+            "transactions_per_tick": transactions / ticks if ticks else None,
+            "transactions_per_route_group": transactions / groups if groups else None
+        },
+        "detection_delay_seconds": {
+            "first_email": summarize(first_delays),
+            "all_subscribers": summarize(last_delays),
+            "missed_events": missed
+        },
+        "emails": {"received": len(sink.received), "spurious": spurious}
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+from datetime import datetime
+from train_record import SEAT_NAMES
+
+NOTIFY_COOLDOWN = 60 * 60 * 3  # 余票没有变化时，最多每 3 小时重复提醒一次
+VOLATILITY_ALPHA = 0.3  # 线路波动率的指数平滑系数，越大越看重最近几次查询
+
+# 通知决策
+SKIP, NOTIFY, CLEAR = 0, 1, 2
+
+
+def count_bucket(count):
+    """余票数分档，避免 5 张变 4 张这种小波动触发通知：1=少量(1~4) 2=一些(5~19) 3=充足(>=20 或"有")"""
+    if count == '有':
+        return 3
+    if count.isdigit():
+        n = int(count)
+        return 1 if n < 5 else (2 if n < 20 else 3)
+    return 3  # 其它非空标记 (如未起售) 按原逻辑视为有票
+
+
+def digest(entries):
+    """条目集合 -> 16 位十六进制摘要 (顺序无关)；空集合返回空串"""
+    if not entries:
+        return ""
+    h = hashlib.blake2b(digest_size=8)
+    for entry in sorted(entries):
+        h.update(repr(entry).encode())
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def encode_entries(entries):
+    """
+    任务相关余票 -> 可比较的紧凑文本 (存入 tasks.notify_digest)；空集合返回空串
+    每项为 "车次+席别的 8 位摘要:余票档位"，按键排序、逗号分隔，据此能判断新增的车次/席别与档位上升
+    """
+    if not entries:
+        return ""
+    state = {}
+    for *key, bucket in entries:
+        key = hashlib.blake2b(repr(tuple(key)).encode(), digest_size=4).hexdigest()
+        state[key] = max(bucket, state.get(key, 0))
+    return ",".join(f"{key}:{bucket}" for key, bucket in sorted(state.items()))
+
+
+def _decode_entries(text):
+    """encode_entries 的逆过程：{键摘要: 档位}；旧版存的整体摘要解析为空 (视为全部是新余票)"""
+    state = {}
+    for item in (text or "").split(","):
+        key, sep, bucket = item.partition(":")
+        if sep and bucket.isdigit():
+            state[key] = int(bucket)
+    return state
+
+
+def route_snapshot(trains):
+    """线路快照摘要：车次 × 席别 -> 余票档位"""
+    entries = []
+    for train in trains:
+        mask = train.mask
+        for bit, name in enumerate(SEAT_NAMES):
+            if mask >> bit & 1:
+                entries.append((train.code, bit, count_bucket(train.counts[bit])))
+    return digest(entries)
+
+
+def seat_entries(codes, seat_list):
+    """['二等:有', '硬卧:3'] -> ((codes, '二等', 3), (codes, '硬卧', 1))"""
+    entries = []
+    for item in seat_list:
+        name, _, count = item.partition(':')
+        entries.append((codes, name, count_bucket(count)))
+    return entries
+
+
+def _to_ts(value):
+    """任务行里的 DATETIME 已是原生 datetime (见 database._make_rows)"""
+    return value.timestamp() if isinstance(value, datetime) else None
+
+
+def decide(task_entries, stored_entries, last_notify, cooldown=NOTIFY_COOLDOWN):
+    """
+    单个任务是否通知 (task_entries / stored_entries 为 encode_entries 的结果)
+    - 相关余票为空：之前通知过的清掉记录 (CLEAR)，以便下次再出票立即通知
+    - 比上次通知时多出车次/席别，或某项余票档位上升：立即通知，不等冷却
+    - 没有变化，或只是减少 (车次售罄、档位下降)：冷却期过后再提醒一次
+    """
+    if not task_entries:
+        return CLEAR if stored_entries else SKIP
+    stored = _decode_entries(stored_entries)
+    if any(bucket > stored.get(key, 0) for key, bucket in _decode_entries(task_entries).items()):
+        return NOTIFY
+    last = _to_ts(last_notify)
+    if last is None or time.time() - last >= cooldown:
+        return NOTIFY
+    return SKIP
+
+
+class ChangeDetector:
+    """
+    记录每条线路最近一次查询的快照摘要，以及每个任务最近一次按哪个快照评估过
+    线路快照没变、任务也不在待提醒状态时，直接跳过匹配、渲染与发送
+    """
+
+    def __init__(self, cooldown=NOTIFY_COOLDOWN):
+        self.cooldown = cooldown
+        self._route_digest = {}  # route_key -> 快照摘要
+        self._volatility = {}    # route_key -> 快照变化频率的指数平滑 (0~1)，供 poll_policy 调整轮询间隔
+        self._task_seen = {}     # route_key -> {task_id: 评估时的线路快照摘要} (随线路一起丢弃)
+        self._lock = threading.Lock()
+
+    def observe(self, route_key, snapshot):
+        """记录线路的新快照，返回是否与上次不同 (首次观测不计入波动率)"""
+        with self._lock:
+            previous = self._route_digest.get(route_key)
+            changed = previous != snapshot
+            self._route_digest[route_key] = snapshot
+            if previous is not None:
+                old = self._volatility.get(route_key, float(changed))
+                self._volatility[route_key] = old + VOLATILITY_ALPHA * (float(changed) - old)
+        return changed
+
+    def volatility(self, route_key):
+        """线路余票快照的变化频率 (0~1)，尚无两次以上观测时返回 None"""
+        with self._lock:
+            return self._volatility.get(route_key)
+
+    def forget(self, route_keys):
+        """线路已没有任务时丢弃其快照、波动率与组内任务的评估记录"""
+        with self._lock:
+            for route_key in route_keys:
+                self._route_digest.pop(route_key, None)
+                self._volatility.pop(route_key, None)
+                self._task_seen.pop(route_key, None)
+
+    def needs_evaluation(self, route_key, task_id, snapshot, stored_digest, last_notify):
+        """线路快照相对该任务上次评估时有变化，或该任务已到重复提醒时间，才需要重新匹配"""
+        with self._lock:
+            if self._task_seen.get(route_key, {}).get(task_id) != snapshot:
+                return True
+        if not stored_digest:
+            return False
+        last = _to_ts(last_notify)
+        return last is None or time.time() - last >= self.cooldown
+
+    def mark_evaluated(self, route_key, task_ids, snapshot):
+        """评估结果落库之后再调用，避免写库失败时漏发"""
+        with self._lock:
+            seen = self._task_seen.setdefault(route_key, {})
+            for task_id in task_ids:
+                seen[task_id] = snapshot
+
+
+# 进程内共享的变化检测器
+change_detector = ChangeDetector()
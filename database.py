@@ -1,13 +1,29 @@
-import pymysql
 import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
+import metrics
+
+try:
+    import pymysql
+except ImportError:  # 只用 SQLite 后端时可以不装
+    pymysql = None
 
 # 加载环境变量
 load_dotenv()
 
-# ================= MySQL 配置 =================
+# ================= 存储后端配置 =================
+# mysql = MySQL 服务器 (多机部署)；sqlite = 本地文件 (WAL 模式，单机部署/测试，无需数据库服务)
+DB_CONFIG = {
+    "backend": os.getenv("DB_BACKEND") or "mysql"
+}
+
 MYSQL_CONFIG = {
     "host": os.getenv("MYSQL_HOST", "localhost"),
     "port": int(os.getenv("MYSQL_PORT", 3306)),
@@ -17,184 +33,672 @@ MYSQL_CONFIG = {
     "charset": "utf8mb4"
 }
 
+SQLITE_CONFIG = {
+    "path": os.getenv("SQLITE_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "ticket_monitor.db"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS") or 5000),  # 等待其它进程释放写锁的最长毫秒数
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS") or "NORMAL",  # WAL 下 NORMAL 只在检查点 fsync，断电最多丢最近的事务
+    "cache_mb": int(os.getenv("SQLITE_CACHE_MB") or 32),  # 每个连接的页缓存
+    "mmap_mb": int(os.getenv("SQLITE_MMAP_MB") or 256)  # 内存映射读取的上限
+}
+
+# 连接池配置 (Worker 与 Streamlit 各自进程内共享一个池)
+POOL_CONFIG = {
+    "size": int(os.getenv("MYSQL_POOL_SIZE") or 5),               # 最大连接数
+    "idle_timeout": int(os.getenv("MYSQL_POOL_IDLE_SECONDS") or 300),  # 空闲超过该秒数的连接被回收
+    "check_interval": int(os.getenv("MYSQL_POOL_CHECK_SECONDS") or 30),  # 空闲超过该秒数，借出前先 ping
+    "acquire_timeout": int(os.getenv("MYSQL_POOL_TIMEOUT") or 10)  # 池满时等待连接的最长秒数
+}
+
+
+class MySQLBackend:
+    """MySQL 后端：语句原样执行，行锁靠 SELECT ... FOR UPDATE"""
+    name = "mysql"
+    for_update = " FOR UPDATE"
+    insert_ignore = "INSERT IGNORE"
+    now_epoch = "UNIX_TIMESTAMP(NOW(6))"  # 数据库时钟 (秒，浮点)
+    serial = "INT AUTO_INCREMENT PRIMARY KEY"
+    big_serial = "BIGINT AUTO_INCREMENT PRIMARY KEY"
+    transactional_ddl = False  # DDL 会隐式提交
+
+    def __init__(self, config):
+        if pymysql is None:
+            raise ImportError("DB_BACKEND=mysql 需要安装 pymysql")
+        self.config = config
+        self.integrity_errors = (pymysql.err.IntegrityError,)
+        self.broken_errors = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+        self._skip_locked = None  # 服务器是否支持 SKIP LOCKED，首次用到时查询版本
+
+    def skip_locked(self, c):
+        """
+        被别的事务锁住的行直接跳过 (MySQL 8.0+ / MariaDB 10.6+)
+        更老的版本不支持 SKIP LOCKED，退回普通 FOR UPDATE：领取时会等别的 Worker 的领取事务提交，结果仍然正确
+        """
+        if self._skip_locked is None:
+            c.execute("SELECT VERSION()")
+            version = c.fetchone()[0]
+            numbers = tuple(int(n) for n in re.findall(r"\d+", version)[:2])
+            self._skip_locked = numbers >= ((10, 6) if "mariadb" in version.lower() else (8, 0))
+        return " FOR UPDATE SKIP LOCKED" if self._skip_locked else self.for_update
+
+    def connect(self):
+        cfg = self.config
+        return pymysql.connect(host=cfg["host"], port=cfg["port"], user=cfg["user"], password=cfg["password"],
+                               database=cfg["database"], charset=cfg["charset"])
+
+    def begin(self, conn, locking):
+        """autocommit 关闭，首条语句隐式开启事务"""
+
+    # ---------- 迁移用 ----------
+
+    def column_exists(self, c, table, column):
+        c.execute('''SELECT 1 FROM information_schema.COLUMNS
+                     WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s AND COLUMN_NAME=%s''',
+                  (self.config["database"], table, column))
+        return c.fetchone() is not None
+
+    def index_exists(self, c, table, index):
+        c.execute('''SELECT 1 FROM information_schema.STATISTICS
+                     WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s AND INDEX_NAME=%s LIMIT 1''',
+                  (self.config["database"], table, index))
+        return c.fetchone() is not None
+
+    def add_updated_at(self, c, table):
+        """自动维护的 updated_at 列 (行被修改时刷新)"""
+        if not self.column_exists(c, table, "updated_at"):
+            c.execute(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+
+    def widen_column(self, c, table, column, definition):
+        """修改已有列的类型 (只用于放宽长度)"""
+        c.execute(f"ALTER TABLE {table} MODIFY COLUMN {column} {definition}")
+
+    def lock(self, c, name, timeout):
+        """跨进程的命名锁 (迁移用)"""
+        c.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+
+    def unlock(self, c, name):
+        c.execute("SELECT RELEASE_LOCK(%s)", (name,))
+
+
+class _SQLiteCursor:
+    """把 pymysql 风格的 %s 占位符转换成 SQLite 的 ?，并支持 with 语句"""
+
+    def __init__(self, conn):
+        self.connection = conn
+        self._cursor = conn.raw.cursor()
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(_to_qmark(sql), tuple(params))
+
+    def executemany(self, sql, seq_of_params):
+        return self._cursor.executemany(_to_qmark(sql), [tuple(p) for p in seq_of_params])
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _SQLiteConnection:
+    """包装 sqlite3 连接，提供连接池用到的 open / ping 接口；事务由 begin/commit/rollback 显式控制"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.open = True
+
+    def cursor(self):
+        return _SQLiteCursor(self)
+
+    def ping(self, reconnect=False):
+        self.raw.execute("SELECT 1")
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute("COMMIT")
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute("ROLLBACK")
+
+    def close(self):
+        self.open = False
+        self.raw.close()
+
+
+def _to_qmark(sql):
+    # 语句里没有字面量 %，直接替换即可
+    return sql.replace("%s", "?")
+
+
+class SQLiteBackend:
+    """
+    SQLite 后端 (WAL 模式)：读写不互相阻塞，写事务之间串行
+    SQLite 没有行锁：需要 "先读后写" 的事务 (FOR UPDATE 的场景) 以 BEGIN IMMEDIATE 开启，提前拿到写锁
+    """
+    name = "sqlite"
+    for_update = ""
+    insert_ignore = "INSERT OR IGNORE"
+    now_epoch = "((julianday('now') - 2440587.5) * 86400.0)"
+    serial = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    big_serial = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    transactional_ddl = True
+    integrity_errors = (sqlite3.IntegrityError,)
+    broken_errors = (sqlite3.InterfaceError,)
+
+    def __init__(self, config):
+        self.config = config
+
+    def connect(self):
+        cfg = self.config
+        # isolation_level=None：由 begin() 显式开启事务；连接只会被连接池借给一个线程使用
+        raw = sqlite3.connect(cfg["path"], timeout=cfg["busy_timeout"] / 1000,
+                              isolation_level=None, check_same_thread=False)
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute(f"PRAGMA synchronous={cfg['synchronous']}")
+        raw.execute(f"PRAGMA busy_timeout={int(cfg['busy_timeout'])}")
+        raw.execute(f"PRAGMA cache_size={-1024 * int(cfg['cache_mb'])}")
+        raw.execute(f"PRAGMA mmap_size={1024 * 1024 * int(cfg['mmap_mb'])}")
+        raw.execute("PRAGMA temp_store=MEMORY")
+        return _SQLiteConnection(raw)
+
+    def begin(self, conn, locking):
+        conn.raw.execute("BEGIN IMMEDIATE" if locking else "BEGIN")
+
+    def skip_locked(self, c):
+        """BEGIN IMMEDIATE 已串行化领取事务，无需行锁"""
+        return ""
+
+    # ---------- 迁移用 ----------
+
+    def column_exists(self, c, table, column):
+        c.execute(f"PRAGMA table_info({table})")
+        return any(row[1] == column for row in c.fetchall())
+
+    def index_exists(self, c, table, index):
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND tbl_name=%s AND name=%s", (table, index))
+        return c.fetchone() is not None
+
+    def add_updated_at(self, c, table):
+        # SQLite 没有 ON UPDATE CURRENT_TIMESTAMP，用触发器维护 (本地时间，与程序写入的 datetime.now() 一致)
+        if not self.column_exists(c, table, "updated_at"):
+            c.execute(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME")
+        for event in ("INSERT", "UPDATE"):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS {table}_updated_at_{event.lower()} AFTER {event} ON {table}
+                         BEGIN
+                             UPDATE {table} SET updated_at=datetime('now', 'localtime') WHERE rowid=NEW.rowid;
+                         END''')
+
+    def widen_column(self, c, table, column, definition):
+        """SQLite 不限制 VARCHAR 长度，无需修改"""
+
+    def lock(self, c, name, timeout):
+        """BEGIN IMMEDIATE 已持有整库写锁，无需命名锁"""
+
+    def unlock(self, c, name):
+        pass
+
+
+# datetime 以 MySQL DATETIME 的文本格式存入 SQLite，读出时由 _make_rows 统一转换
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" ", "seconds"))
+
+
+def create_backend(config=DB_CONFIG):
+    if config["backend"] == "mysql":
+        return MySQLBackend(MYSQL_CONFIG)
+    if config["backend"] == "sqlite":
+        return SQLiteBackend(SQLITE_CONFIG)
+    raise ValueError(f"未知的存储后端: {config['backend']}")
+
+
+# 进程内使用的存储后端
+backend = create_backend()
+
 def get_conn():
-    """获取 MySQL 连接"""
-    return pymysql.connect(
-        host=MYSQL_CONFIG["host"],
-        port=MYSQL_CONFIG["port"],
-        user=MYSQL_CONFIG["user"],
-        password=MYSQL_CONFIG["password"],
-        database=MYSQL_CONFIG["database"],
-        charset=MYSQL_CONFIG["charset"]
-    )
-
-def init_db():
-    """初始化数据库表结构 (MySQL版)"""
-    try:
-        conn = get_conn()
-        c = conn.cursor()
-        
-        # 用户表
-        c.execute('''CREATE TABLE IF NOT EXISTS users (
-                        username VARCHAR(255) PRIMARY KEY,
-                        password_hash VARCHAR(255) NOT NULL,
-                        email VARCHAR(255),
-                        created_at DATETIME
-                    )''')
-        
-        # 任务表
-        c.execute('''CREATE TABLE IF NOT EXISTS tasks (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        username VARCHAR(255),
-                        from_station VARCHAR(50),
-                        to_station VARCHAR(50),
-                        date_str VARCHAR(20),
-                        train_types VARCHAR(255),
-                        seat_types VARCHAR(255),
-                        receiver_email VARCHAR(255),
-                        status INT DEFAULT 1 COMMENT '1=监控中, 0=停止, 2=完成', 
-                        created_at DATETIME,
-                        last_check_time DATETIME,
-                        last_notification_time DATETIME
-                    )''')
-        
-        # 尝试添加 last_notification_time 字段 (兼容旧表)
+    """获取一个新的数据库连接"""
+    return backend.connect()
+
+class ConnectionPool:
+    """线程安全的数据库连接池：限制连接数、借出前健康检查、回收空闲连接"""
+
+    def __init__(self, size, idle_timeout, check_interval, acquire_timeout):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = deque()  # (conn, 归还时间)，右端为最近归还的热连接
+        self._created = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while True:
+                expired = self._pop_expired()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._created < self.size:
+                    self._created += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("数据库连接池已满，等待超时")
+                self._cond.wait(remaining)
+        self._close_all(expired)
+
+        if conn is None:
+            return self._connect()
+
+        # 空闲较久的连接可能已被服务端断开，先 ping 一下 (断开则原地重连)
+        if time.monotonic() - last_used > self.check_interval:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self._close_all([conn])
+                return self._connect()
+        return conn
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            if broken or not conn.open:
+                self._created -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._close_all([conn])
+
+    def close(self):
+        """关闭所有空闲连接 (借出中的连接归还后照常入池)"""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._created -= len(idle)
+            self._cond.notify_all()
+        self._close_all(idle)
+
+    def _connect(self):
         try:
-            c.execute("ALTER TABLE tasks ADD COLUMN last_notification_time DATETIME")
+            return get_conn()
         except Exception:
-            pass 
-            
-        # 尝试添加 middle_station 字段 (兼容旧表 - 支持中转)
+            # 建连失败要把名额还回去，否则池会慢慢"漏"光
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _pop_expired(self):
+        # 调用方需持有锁；左端是最久未用的连接
+        expired = []
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            expired.append(self._idle.popleft()[0])
+        self._created -= len(expired)
+        return expired
+
+    @staticmethod
+    def _close_all(conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+_pool = ConnectionPool(**POOL_CONFIG)
+
+def get_pool():
+    return _pool
+
+@contextmanager
+def db_cursor(locking=False):
+    """
+    从连接池借出连接并返回游标，with 块即一个事务：
+    正常退出提交 (只读查询也提交，以结束事务快照)，异常时回滚，最后归还连接
+    块内先读后写 (SELECT ... FOR UPDATE) 时传 locking=True：SQLite 后端以 BEGIN IMMEDIATE 开启事务
+    """
+    conn = _pool.acquire()
+    metrics.DB_TRANSACTIONS.inc()
+    broken = False
+    try:
+        backend.begin(conn, locking)
+        with conn.cursor() as c:
+            yield c
+        conn.commit()
+    except backend.broken_errors:
+        broken = True
+        raise
+    except Exception:
         try:
-            c.execute("ALTER TABLE tasks ADD COLUMN middle_station VARCHAR(50) DEFAULT NULL")
+            conn.rollback()
         except Exception:
-            pass
-
-        # 请求日志表 (用于限流)
-        c.execute('''CREATE TABLE IF NOT EXISTS request_logs (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        req_time DATETIME
-                    )''')
-        
-        conn.commit()
-        conn.close()
-        print("✅ MySQL 数据库表结构初始化完成")
-    except Exception as e:
-        print(f"❌ 数据库连接失败，请检查配置: {e}")
+            broken = True
+        raise
+    finally:
+        _pool.release(conn, broken)
+
+# ================= 任务行类型 =================
+# 每类调用方只查自己用到的列 (显式投影，不再 SELECT *)，返回按列名访问的轻量行对象
+
+class WorkerTask(namedtuple("WorkerTask", (
+        "id", "from_station", "to_station", "date_str", "train_types", "seat_types", "receiver_email",
+        "status", "last_check_time", "last_notification_time", "middle_station", "updated_at",
+        "train_codes", "depart_window", "arrive_window", "notify_digest"))):
+    """后台 Worker 调度、查询与通知用到的任务列"""
+    __slots__ = ()
+
+    @property
+    def route_key(self):
+        """线路分组键: (出发, 到达, 日期, 中转站)"""
+        return (self.from_station, self.to_station, self.date_str, self.middle_station)
+
+
+class TaskListItem(namedtuple("TaskListItem", (
+        "id", "from_station", "to_station", "date_str", "seat_types", "status",
+        "last_check_time", "last_notification_time", "middle_station"))):
+    """Web 前台任务列表用到的任务列"""
+    __slots__ = ()
+
+
+WORKER_TASK_COLUMNS = ", ".join(WorkerTask._fields)
+TASK_LIST_COLUMNS = ", ".join(TaskListItem._fields)
+_DATETIME_FIELDS = {"last_check_time", "last_notification_time", "updated_at", "created_at"}
+
+
+def _as_datetime(value):
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value[:19], "%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            return None
+    return value
+
+def _make_rows(row_type, rows):
+    """数据库行 -> 行对象；DATETIME 列若以字符串返回 (旧表或其它驱动)，在这里统一转换一次"""
+    positions = [i for i, name in enumerate(row_type._fields) if name in _DATETIME_FIELDS]
+    result = []
+    for row in rows:
+        if any(isinstance(row[i], str) for i in positions):
+            row = list(row)
+            for i in positions:
+                row[i] = _as_datetime(row[i])
+        result.append(row_type._make(row))
+    return result
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 def register_user(username, password, email):
-    conn = get_conn()
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO users (username, password_hash, email, created_at) VALUES (%s, %s, %s, %s)", 
-                  (username, hash_password(password), email, datetime.now()))
-        conn.commit()
+        with db_cursor() as c:
+            c.execute("INSERT INTO users (username, password_hash, email, created_at) VALUES (%s, %s, %s, %s)", 
+                      (username, hash_password(password), email, datetime.now()))
         return True
-    except pymysql.err.IntegrityError:
+    except backend.integrity_errors:
         return False
-    finally:
-        conn.close()
 
 def login_user(username, password):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username=%s AND password_hash=%s", (username, hash_password(password)))
-    user = c.fetchone()
-    conn.close()
-    return user
-
-def add_task(username, from_st, to_st, date, t_types, s_types, email, middle_st=None):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute('''INSERT INTO tasks (username, from_station, to_station, date_str, train_types, seat_types, receiver_email, created_at, status, middle_station)
-                 VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1, %s)''',
-              (username, from_st, to_st, date, t_types, s_types, email, datetime.now(), middle_st))
-    conn.commit()
-    conn.close()
-
-def get_user_tasks(username):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM tasks WHERE username=%s ORDER BY created_at DESC", (username,))
-    tasks = c.fetchall()
-    conn.close()
-    return tasks
+    with db_cursor() as c:
+        c.execute("SELECT * FROM users WHERE username=%s AND password_hash=%s", (username, hash_password(password)))
+        return c.fetchone()
+
+def add_task(username, from_st, to_st, date, t_types, s_types, email, middle_st=None,
+             train_codes=None, depart_window=None, arrive_window=None):
+    with db_cursor() as c:
+        c.execute('''INSERT INTO tasks (username, from_station, to_station, date_str, train_types, seat_types, receiver_email, created_at, status, middle_station,
+                                        train_codes, depart_window, arrive_window)
+                     VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1, %s, %s, %s, %s)''',
+                  (username, from_st, to_st, date, t_types, s_types, email, datetime.now(), middle_st,
+                   train_codes, depart_window, arrive_window))
+
+def get_user_tasks_page(username, status=None, page=1, page_size=10):
+    """
+    分页查询用户的任务 (按创建时间倒序)，status 为 None 时不限状态
+    返回 ([TaskListItem], 符合条件的总数)
+    """
+    where, params = "username=%s", [username]
+    if status is not None:
+        where += " AND status=%s"
+        params.append(status)
+    with db_cursor() as c:
+        c.execute(f"SELECT COUNT(*) FROM tasks WHERE {where}", params)
+        total = c.fetchone()[0]
+        c.execute(f"SELECT {TASK_LIST_COLUMNS} FROM tasks WHERE {where} ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s",
+                  (*params, page_size, (page - 1) * page_size))
+        return _make_rows(TaskListItem, c.fetchall()), total
 
 def delete_task(task_id):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM tasks WHERE id=%s", (task_id,))
-    conn.commit()
-    conn.close()
-
-# --- 限流控制函数 ---
-
-def can_make_request(limit=2, window_seconds=60):
-    """
-    检查是否可以发起请求
-    逻辑：统计过去 window_seconds 秒内的请求记录数
-    """
-    conn = get_conn()
-    c = conn.cursor()
-    # 清理过期的日志 (保持表轻量)
-    c.execute("DELETE FROM request_logs WHERE req_time < %s", (datetime.now() - timedelta(seconds=window_seconds*2),))
-    conn.commit()
-    
-    # 检查当前窗口内的数量
-    c.execute("SELECT COUNT(*) FROM request_logs WHERE req_time > %s", (datetime.now() - timedelta(seconds=window_seconds),))
-    count = c.fetchone()[0]
-    conn.close()
-    
-    return count < limit
-
-def record_request():
-    """记录一次请求"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO request_logs (req_time) VALUES (%s)", (datetime.now(),))
-    conn.commit()
-    conn.close()
+    with db_cursor() as c:
+        c.execute("DELETE FROM tasks WHERE id=%s", (task_id,))
 
 # --- 供后台 Worker 调用的专用函数 ---
 
 def get_active_tasks():
     """获取所有状态为1(监控中)的任务"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT * FROM tasks WHERE status=1")
-    tasks = c.fetchall()
-    conn.close()
-    return tasks
-
-def update_notification_time(task_id):
-    """更新最后通知时间"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE tasks SET last_notification_time=%s WHERE id=%s", (datetime.now(), task_id))
-    conn.commit()
-    conn.close()
-
-def update_check_time(task_id):
-    """更新最后检查时间 (用于控制轮询频率)"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE tasks SET last_check_time=%s WHERE id=%s", (datetime.now(), task_id))
-    conn.commit()
-    conn.close()
+    with db_cursor() as c:
+        c.execute(f"SELECT {WORKER_TASK_COLUMNS} FROM tasks WHERE status=1")
+        return _make_rows(WorkerTask, c.fetchall())
+
+def get_tasks_changed_since(last_id, since):
+    """增量同步：返回 id 大于 last_id 或 updated_at 不早于 since 的任务 (含已停止/完成的，供调度器剔除)"""
+    with db_cursor() as c:
+        c.execute(f"SELECT {WORKER_TASK_COLUMNS} FROM tasks WHERE id > %s OR updated_at >= %s", (last_id, since))
+        return _make_rows(WorkerTask, c.fetchall())
+
+def get_active_tasks_by_ids(task_ids):
+    """按 id 重新读取仍处于监控中的任务 (执行前校验，过滤掉已删除/停止的)"""
+    task_ids = list(task_ids)
+    if not task_ids:
+        return []
+    placeholders = ",".join(["%s"] * len(task_ids))
+    with db_cursor() as c:
+        c.execute(f"SELECT {WORKER_TASK_COLUMNS} FROM tasks WHERE status=1 AND id IN ({placeholders})", task_ids)
+        return _make_rows(WorkerTask, c.fetchall())
+
+def update_check_time_many(task_ids):
+    """批量更新最后检查时间 (同一线路组的任务一次更新)"""
+    _update_time_many("last_check_time", task_ids)
+
+def _update_time_many(column, task_ids):
+    task_ids = list(task_ids)
+    if not task_ids:
+        return
+    placeholders = ",".join(["%s"] * len(task_ids))
+    with db_cursor() as c:
+        c.execute(f"UPDATE tasks SET {column}=%s WHERE id IN ({placeholders})", (datetime.now(), *task_ids))
+
+# --- 通知发件箱 ---
+
+def enqueue_notifications(items):
+    """
+    写入发件箱，并在同一事务内推进这些任务的最后通知时间与余票摘要
+    items 为 [(task_id, 收件人, 标题, 余票列表 HTML, 是否中转, 余票摘要)]，正文在发送时才套版 (便于合并成汇总邮件)
+    """
+    items = list(items)
+    if not items:
+        return
+    now = datetime.now()
+    with db_cursor() as c:
+        c.executemany('''INSERT INTO notification_outbox (task_id, receiver_email, subject, body, is_transfer, status, attempts, next_attempt_at, created_at)
+                         VALUES (%s, %s, %s, %s, %s, 0, 0, %s, %s)''',
+                      [(task_id, email, subject, body, int(is_transfer), now, now)
+                       for task_id, email, subject, body, is_transfer, _ in items])
+        c.executemany("UPDATE tasks SET last_notification_time=%s, notify_digest=%s WHERE id=%s",
+                      [(now, task_digest, task_id) for task_id, _, _, _, _, task_digest in items])
+
+def clear_notify_digest(task_ids):
+    """相关余票已经没了：清空摘要，下次再出票时立即通知"""
+    task_ids = list(task_ids)
+    if not task_ids:
+        return
+    placeholders = ",".join(["%s"] * len(task_ids))
+    with db_cursor() as c:
+        c.execute(f"UPDATE tasks SET notify_digest=NULL WHERE id IN ({placeholders})", task_ids)
+
+def claim_notifications(limit, lease_seconds, digest_window=0):
+    """
+    按收件人领取一批到期待发送的通知：行锁内把 next_attempt_at 推后 lease_seconds 并累加尝试次数，
+    发送进程中途崩溃的话，租约到期后会被重新领取
+    - limit 为本批最多领取的收件人数，每个收件人的到期通知全部领走，以便合并成一封汇总邮件
+    - 收件人最早的一条通知入箱满 digest_window 秒才领取，窗口内其它线路的命中会一起发出
+    返回 [(id, task_id, 收件人, 标题, 余票列表 HTML, 是否中转, 已尝试次数)]，同一收件人的行相邻
+    """
+    now = datetime.now()
+    with db_cursor(locking=True) as c:
+        c.execute('''SELECT receiver_email FROM notification_outbox
+                     WHERE status=0 AND next_attempt_at <= %s
+                     GROUP BY receiver_email HAVING MIN(created_at) <= %s
+                     ORDER BY MIN(id) LIMIT %s''', (now, now - timedelta(seconds=digest_window), limit))
+        emails = [row[0] for row in c.fetchall()]
+        if not emails:
+            return []
+        placeholders = ",".join(["%s"] * len(emails))
+        c.execute(f'''SELECT id, task_id, receiver_email, subject, body, is_transfer, attempts FROM notification_outbox
+                      WHERE status=0 AND next_attempt_at <= %s AND receiver_email IN ({placeholders})
+                      ORDER BY receiver_email, id{backend.for_update}''', (now, *emails))
+        rows = c.fetchall()
+        if rows:
+            placeholders = ",".join(["%s"] * len(rows))
+            c.execute(f"UPDATE notification_outbox SET attempts=attempts+1, next_attempt_at=%s WHERE id IN ({placeholders})",
+                      (now + timedelta(seconds=lease_seconds), *[row[0] for row in rows]))
+    return [row[:5] + (bool(row[5]), row[6] + 1) for row in rows]
+
+def mark_notifications_sent(outbox_ids):
+    outbox_ids = list(outbox_ids)
+    if not outbox_ids:
+        return
+    placeholders = ",".join(["%s"] * len(outbox_ids))
+    with db_cursor() as c:
+        c.execute(f"UPDATE notification_outbox SET status=1, sent_at=%s WHERE id IN ({placeholders})",
+                  (datetime.now(), *outbox_ids))
+
+def mark_notification_failed(outbox_id, error, retry_at=None):
+    """发送失败：retry_at 为空表示放弃 (status=2)，否则等到 retry_at 再重试"""
+    with db_cursor() as c:
+        if retry_at is None:
+            c.execute("UPDATE notification_outbox SET status=2, last_error=%s WHERE id=%s", (error[:255], outbox_id))
+        else:
+            c.execute("UPDATE notification_outbox SET next_attempt_at=%s, last_error=%s WHERE id=%s",
+                      (retry_at, error[:255], outbox_id))
+
+def prune_outbox(retention_days):
+    """
+    删除已发送/已放弃且超过保留天数的通知，返回删除的行数
+    按 next_attempt_at 判断 (最后一次领取时推后的时刻，即发送或放弃的时间)，可以走 (status, next_attempt_at) 索引
+    """
+    with db_cursor() as c:
+        c.execute("DELETE FROM notification_outbox WHERE status IN (1, 2) AND next_attempt_at < %s",
+                  (datetime.now() - timedelta(days=retention_days),))
+        return c.rowcount
+
+# --- 线路租约 (多 Worker 分片) ---
+# route_leases 每条线路一行：owner 为持有者，lease_until 为到期时刻 (数据库时钟，避免各节点时钟不一致)
+
+def route_lease_key(route_key):
+    """线路分组键 -> 租约表主键: '出发|到达|日期|中转站'"""
+    return "|".join(part or "" for part in route_key)
+
+def ensure_route_leases(keys):
+    """为还没有租约行的线路建行 (已存在的忽略)"""
+    keys = list(keys)
+    if not keys:
+        return
+    with db_cursor() as c:
+        c.executemany(f"{backend.insert_ignore} INTO route_leases (route_key, owner, lease_until) VALUES (%s, '', 0)",
+                      [(key,) for key in keys])
+
+def claim_route_leases(keys, owner, ttl):
+    """
+    原子地领取空闲 (无人持有或已过期) 的线路租约，有效期 ttl 秒，返回领到的 key 列表
+    别的 Worker 正在领取的行被 SKIP LOCKED 跳过，不会互相等待 (不支持时退回 FOR UPDATE)
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+    placeholders = ",".join(["%s"] * len(keys))
+    with db_cursor(locking=True) as c:
+        c.execute(f'''SELECT route_key FROM route_leases
+                      WHERE route_key IN ({placeholders}) AND (owner IN ('', %s) OR lease_until < {backend.now_epoch}){backend.skip_locked(c)}''',
+                  (*keys, owner))
+        free = [row[0] for row in c.fetchall()]
+        if free:
+            placeholders = ",".join(["%s"] * len(free))
+            c.execute(f"UPDATE route_leases SET owner=%s, lease_until={backend.now_epoch} + %s WHERE route_key IN ({placeholders})",
+                      (owner, ttl, *free))
+    return free
+
+def renew_route_leases(keys, owner, ttl):
+    """心跳：延长仍由 owner 持有的租约，返回成功延长的个数 (少于 len(keys) 说明有租约已过期被别人领走)"""
+    keys = list(keys)
+    if not keys:
+        return 0
+    placeholders = ",".join(["%s"] * len(keys))
+    with db_cursor() as c:
+        c.execute(f"UPDATE route_leases SET lease_until={backend.now_epoch} + %s WHERE owner=%s AND route_key IN ({placeholders})",
+                  (ttl, owner, *keys))
+        return c.rowcount
+
+def release_route_leases(keys, owner):
+    """
+    执行结束，归还租约 (只归还自己持有的)：owner 置空即可被领取，lease_until 记为归还时刻，供清理判断线路多久没人查了
+    (不能靠 lease_until 判断是否空闲：同一时钟刻度内再领取时 lease_until 并不小于当前时刻)
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    placeholders = ",".join(["%s"] * len(keys))
+    with db_cursor() as c:
+        c.execute(f"UPDATE route_leases SET owner='', lease_until={backend.now_epoch} WHERE owner=%s AND route_key IN ({placeholders})",
+                  (owner, *keys))
+
+def prune_route_leases(idle_seconds, today):
+    """
+    删除不再需要的租约行 (当前无人持有的)：超过 idle_seconds 没人领取的 (任务已删除/停止)，或出发日期早于 today 的
+    返回删除的行数；被删掉但仍有任务的线路，下次领取时会重新建行
+    """
+    with db_cursor() as c:
+        c.execute(f'''SELECT route_key, lease_until < {backend.now_epoch} - %s FROM route_leases
+                      WHERE owner='' OR lease_until < {backend.now_epoch}''', (idle_seconds,))
+        stale = [key for key, idle in c.fetchall() if idle or key.split("|")[2] < today]
+        if not stale:
+            return 0
+        placeholders = ",".join(["%s"] * len(stale))
+        # 再次确认无人持有：SELECT 之后被别的 Worker 领走的行不删
+        c.execute(f"DELETE FROM route_leases WHERE route_key IN ({placeholders}) AND (owner='' OR lease_until < {backend.now_epoch})",
+                  stale)
+        return c.rowcount
+
+def heartbeat_worker(owner, host, ttl):
+    """登记 Worker 在 ttl 秒内仍在运行，顺带清理早已下线的记录，返回当前在线的主机数"""
+    with db_cursor() as c:
+        c.execute(f"{backend.insert_ignore} INTO worker_heartbeats (owner, host, seen_until) VALUES (%s, %s, 0)", (owner, host))
+        c.execute(f"UPDATE worker_heartbeats SET host=%s, seen_until={backend.now_epoch} + %s WHERE owner=%s", (host, ttl, owner))
+        c.execute(f"DELETE FROM worker_heartbeats WHERE seen_until < {backend.now_epoch} - 86400")
+        c.execute(f"SELECT COUNT(DISTINCT host) FROM worker_heartbeats WHERE seen_until >= {backend.now_epoch}")
+        return c.fetchone()[0]
 
 def mark_task_completed(task_id):
     """标记任务为已完成"""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE tasks SET status=2 WHERE id=%s", (task_id,))
-    conn.commit()
-    conn.close()
-
-# 尝试初始化 (自动执行，确保表存在)
-init_db()
+    with db_cursor() as c:
+        c.execute("UPDATE tasks SET status=2 WHERE id=%s", (task_id,))
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
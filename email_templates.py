@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# 通知邮件模板：查询路径只生成余票列表 HTML，由 notification_dispatcher 在发送时套版
+
+# 单条监控的余票列表框
+_TICKET_BOX = """
+                <div style="background-color: #F8F9FA; border-left: 4px solid #613D31; padding: 20px; margin: 25px 0; background-image: linear-gradient(to right, #f8f9fa, #ffffff);">
+                    <ul style="margin: 0; padding-left: 20px; list-style-type: none; font-family: 'Microsoft YaHei', sans-serif; font-size: 16px;">
+                        {tickets_html}
+                    </ul>
+                </div>
+"""
+
+
+def _render_email(title_text, content_html):
+    """邮件外框：标题栏、提示语、购票按钮与落款"""
+    return f"""
+    <div style="background-color: #FBFBF6; padding: 40px; font-family: 'STSong', 'SimSun', serif; color: #293C55;">
+        <div style="max-width: 600px; margin: 0 auto; background: #ffffff; border: 1px solid #e0e0e0; border-radius: 8px; box-shadow: 0 4px 15px rgba(0,0,0,0.05); overflow: hidden;">
+            <div style="background-color: #293C55; color: #FBFBF6; padding: 25px; text-align: center;">
+                <h2 style="margin: 0; font-size: 24px; letter-spacing: 4px; font-weight: normal;">12306 云监控提醒</h2>
+            </div>
+            <div style="padding: 35px; line-height: 1.8;">
+                <p style="font-size: 18px; color: #D93D3B; font-weight: bold; border-bottom: 2px solid #F2A626; padding-bottom: 10px; display: inline-block; margin-top: 0;">
+                    {title_text}
+                </p>
+                <p style="margin-top: 20px; font-family: 'Microsoft YaHei', sans-serif;">尊敬的用户，为您监控到以下车次已有余票，请尽快处理：</p>
+{content_html}
+                <div style="font-size:13px; color:#999; margin-top:10px; background:#fff3cd; padding:10px; border-radius:4px;">
+                    ⚠️ 为了保护服务器IP不被封禁，系统采用低频轮询策略。请勿手动频繁刷新，以免影响监控。
+                </div>
+                <div style="text-align: center; margin-top: 35px;">
+                    <a href="https://kyfw.12306.cn/" style="background-color: #D93D3B; color: #ffffff; padding: 12px 30px; text-decoration: none; border-radius: 4px; font-weight: bold; display: inline-block; box-shadow: 0 2px 5px rgba(217,61,59,0.3);">
+                        立即前往 12306 购票
+                    </a>
+                </div>
+            </div>
+            <div style="background-color: #FBFBF6; padding: 25px; text-align: right; border-top: 1px dotted #ccc; color: #666; font-size: 14px;">
+                <p style="margin: 0; font-style: italic;">山水有相逢，愿您旅途愉快。</p>
+                <p style="margin: 8px 0 0 0; font-weight: bold; color: #613D31; font-size: 16px;">
+                    <span style="font-weight: normal; font-size: 12px; color: #999;">--</span> by 呼啦啦啦桃猪
+                </p>
+            </div>
+        </div>
+    </div>
+    """
+
+
+def generate_email_html(tickets_html, is_transfer=False):
+    """生成统一的邮件 HTML"""
+    title_text = "中转方案推荐" if is_transfer else "发现直达余票"
+    return _render_email(title_text, _TICKET_BOX.format(tickets_html=tickets_html))
+
+
+def generate_digest_html(sections):
+    """同一收件人的多条监控合并为一封汇总邮件，sections 为 [(小标题, tickets_html)]"""
+    content_html = "".join(
+        f"<p style='margin: 25px 0 0 0; font-family: \'Microsoft YaHei\', sans-serif; font-weight: bold; color: #613D31;'>{heading}</p>"
+        + _TICKET_BOX.format(tickets_html=tickets_html)
+        for heading, tickets_html in sections
+    )
+    return _render_email(f"余票汇总 ({len(sections)} 条监控)", content_html)
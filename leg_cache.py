@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LEG_CACHE_CONFIG = {
+    "ttl": float(os.getenv("LEG_CACHE_TTL") or 120),  # 单程查询结果的新鲜期 (秒)
+    "max_size": int(os.getenv("LEG_CACHE_SIZE") or 512)  # 最多缓存多少个 (出发, 到达, 日期)
+}
+
+
+class _Call:
+    """一次进行中的加载，其余线程在 event 上等待结果"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+
+
+class LegCache:
+    """
+    单程查询结果缓存: (出发, 到达, 日期) -> 车次列表
+    TTL 过期 + LRU 淘汰；同一程的并发加载只放一个线程去请求 12306 (single-flight)，其余等待共享结果
+    直达 A->B 与中转 A->B->C、A->B->D 的第一程因此在新鲜期内只查一次
+    (命中与搭顺风车的次数由调用方记入 ticket_fetch_cached_total)
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (过期时间, 车次列表)，右端为最近使用
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        """
+        命中且未过期则直接返回；否则调用 loader() 加载
+        loader 返回 None 表示请求失败，失败结果不缓存
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._fresh(key, now):
+                self._data.move_to_end(key)
+                return self._data[key][1]
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            return call.value
+
+        try:
+            call.value = loader()
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if call.value is not None:
+                    self._data[key] = (time.monotonic() + self.ttl, call.value)
+                    self._data.move_to_end(key)
+                    while len(self._data) > self.max_size:
+                        self._data.popitem(last=False)
+            call.event.set()
+        return call.value
+
+    def _fresh(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        if entry[0] <= now:
+            del self._data[key]
+            return False
+        return True
+
+
+# 进程内共享的单程结果缓存
+leg_cache = LegCache(**LEG_CACHE_CONFIG)
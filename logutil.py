@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+
+def log(msg):
+    """带时间戳的日志行 (各进程的 stdout 由 run_server/部署环境统一收集)"""
+    print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}", flush=True)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+from logutil import log
+
+load_dotenv()
+
+METRICS_CONFIG = {
+    "port": int(os.getenv("METRICS_PORT") or 0),  # 0 = 不启动 HTTP 端点
+    "addr": os.getenv("METRICS_ADDR") or "127.0.0.1"  # 默认只监听本机，由本机的 Prometheus 抓取
+}
+
+# 秒级延迟的默认分桶：覆盖 12306 查询 (百毫秒~十秒) 与 SMTP 发送
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    """指标基类：按标签值元组分别计数，渲染成 Prometheus 文本格式"""
+    type_name = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+    def total(self):
+        """所有标签组合的合计值 (仿真/压测在进程内直接读取)"""
+        with self._lock:
+            return sum(self._values.values())
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # 各桶计数, 总和, 总数
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """with HIST.time(kind="direct"): ... 记录代码块耗时 (异常时同样记录)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def total(self):
+        """所有标签组合的观测次数合计"""
+        with self._lock:
+            return sum(state[2] for state in self._values.values())
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+_registry = []
+
+
+def render():
+    """所有已注册指标的 Prometheus 文本格式"""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ================= 指标定义 =================
+# kind 标签: direct = 直达, transfer = 中转
+
+FETCH_SECONDS = Histogram("ticket_fetch_seconds", "12306 余票查询耗时 (不含缓存命中)", ["kind"])
+PACER_WAIT_SECONDS = Histogram("pacer_wait_seconds", "单程查询发出前在节拍器排队等待的时间", ["kind"])
+FETCH_ERRORS = Counter("ticket_fetch_errors_total", "12306 余票查询失败次数", ["kind"])
+FETCH_CACHED = Counter("ticket_fetch_cached_total", "命中单程缓存、未请求 12306 的查询次数", ["kind"])
+SESSION_REINITS = Counter("session_reinits_total", "12306 会话失效 (重定向到登录页或返回非 JSON) 后重新初始化的次数")
+QUERY_URL_CHANGES = Counter("query_url_changes_total", "12306 在响应中告知新查询地址的次数")
+RATE_LIMIT_REJECTIONS = Counter("rate_limit_rejections_total", "因限流跳过的单程查询次数", ["kind"])
+ROUTE_GROUP_SECONDS = Histogram("route_group_seconds", "单条线路组的处理耗时 (查询、匹配与写入发件箱)", ["kind"])
+ROUTE_GROUP_FAILURES = Counter("route_group_failures_total", "线路组处理失败或因限流未执行的次数", ["kind"])
+ROUTE_LEASE_BUSY = Counter("route_lease_busy_total", "到期但租约被其它 Worker 持有而跳过的线路数")
+ROUTE_LEASE_LOST = Counter("route_lease_lost_total", "心跳时发现已过期、可能被其它 Worker 领走的租约数")
+WORKER_TICKS = Counter("worker_ticks_total", "Worker 主循环的轮数")
+TASKS_CHECKED = Counter("tasks_checked_total", "完成检查的任务数", ["kind"])
+DB_TRANSACTIONS = Counter("db_transactions_total", "数据库事务数 (每个 db_cursor 块一次)")
+DUE_BACKLOG = Gauge("scheduler_due_tasks", "已到期、正在排队或执行中的任务数")
+SCHEDULED_TASKS = Gauge("scheduler_tasks", "调度器中监控中的任务总数")
+EMAIL_SEND_SECONDS = Histogram("email_send_seconds", "单封邮件的 SMTP 发送耗时", ["result"])
+NOTIFICATIONS = Counter("notifications_total", "发件箱通知的处理结果", ["kind", "result"])
+
+
+# ================= HTTP 端点 =================
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # 抓取请求不刷屏
+
+
+def start_http_server(port=None, addr=None):
+    """在后台线程提供 /metrics；port 为 0 时不启动，返回 server (或 None)"""
+    port = METRICS_CONFIG["port"] if port is None else port
+    addr = addr or METRICS_CONFIG["addr"]
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((addr, port), _Handler)
+    except OSError as e:
+        log(f"⚠️ 指标端点启动失败 ({addr}:{port}): {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log(f"📈 指标端点: http://{addr}:{port}/metrics")
+    return server
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+数据库结构迁移：按版本号顺序执行，已执行的版本记录在 schema_version 表
+导入 database 不再自动建表，由各进程启动时显式调用 migrate()，也可以单独运行:
+    python migrations.py
+"""
+from datetime import datetime
+from database import db_cursor, backend
+
+MIGRATE_LOCK = "ticket_monitor_migrate"  # 多个进程同时启动时，只有一个在执行迁移
+
+# 建表语句按 MySQL 语法书写，自增主键等方言差异由 backend 提供 (列注释写成 SQL 注释，两种后端都能解析)
+
+
+def _add_column(c, table, column, definition):
+    if not backend.column_exists(c, table, column):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _add_index(c, table, index, columns):
+    if not backend.index_exists(c, table, index):
+        c.execute(f"CREATE INDEX {index} ON {table} ({columns})")
+
+
+# ================= 迁移列表 =================
+# 每个迁移都必须可重复执行 (幂等)：旧库里可能已经由早期的 init_db 建好了部分表和字段
+
+def _v1_base_tables(c):
+    # 用户表
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    username VARCHAR(255) PRIMARY KEY,
+                    password_hash VARCHAR(255) NOT NULL,
+                    email VARCHAR(255),
+                    created_at DATETIME
+                )''')
+
+    # 任务表
+    c.execute(f'''CREATE TABLE IF NOT EXISTS tasks (
+                    id {backend.serial},
+                    username VARCHAR(255),
+                    from_station VARCHAR(50),
+                    to_station VARCHAR(50),
+                    date_str VARCHAR(20),
+                    train_types VARCHAR(255),
+                    seat_types VARCHAR(255),
+                    receiver_email VARCHAR(255),
+                    status INT DEFAULT 1,  -- 1=监控中, 0=停止, 2=完成
+                    created_at DATETIME,
+                    last_check_time DATETIME,
+                    last_notification_time DATETIME
+                )''')
+
+    # 旧表补字段：中转站、增量同步用的 updated_at、可选筛选条件、上次通知时的余票摘要
+    _add_column(c, "tasks", "last_notification_time", "DATETIME")
+    _add_column(c, "tasks", "middle_station", "VARCHAR(50) DEFAULT NULL")
+    backend.add_updated_at(c, "tasks")
+    _add_column(c, "tasks", "train_codes", "VARCHAR(255) DEFAULT NULL")
+    _add_column(c, "tasks", "depart_window", "VARCHAR(20) DEFAULT NULL")
+    _add_column(c, "tasks", "arrive_window", "VARCHAR(20) DEFAULT NULL")
+    _add_column(c, "tasks", "notify_digest", "VARCHAR(32) DEFAULT NULL")
+
+    # 请求日志表 (旧版限流)
+    c.execute(f'''CREATE TABLE IF NOT EXISTS request_logs (
+                    id {backend.serial},
+                    req_time DATETIME
+                )''')
+
+    # 通知发件箱 (查询路径只写入，由 notification_dispatcher 进程负责发送)
+    c.execute(f'''CREATE TABLE IF NOT EXISTS notification_outbox (
+                    id {backend.big_serial},
+                    task_id INT,
+                    receiver_email VARCHAR(255),
+                    subject VARCHAR(255),
+                    body MEDIUMTEXT,  -- 余票列表 HTML，发送时套版
+                    is_transfer TINYINT DEFAULT 0,
+                    status INT DEFAULT 0,  -- 0=待发送, 1=已发送, 2=已放弃
+                    attempts INT DEFAULT 0,
+                    next_attempt_at DATETIME,
+                    last_error VARCHAR(255),
+                    created_at DATETIME,
+                    sent_at DATETIME
+                )''')
+    _add_index(c, "notification_outbox", "idx_outbox_pending", "status, next_attempt_at")
+    _add_column(c, "notification_outbox", "is_transfer", "TINYINT DEFAULT 0")
+
+    # 共享令牌桶 (rate_limiter 的 database 后端)
+    c.execute('''CREATE TABLE IF NOT EXISTS rate_buckets (
+                    name VARCHAR(64) PRIMARY KEY,
+                    tokens DOUBLE NOT NULL,
+                    updated_at DOUBLE NOT NULL
+                )''')
+
+
+def _v2_hot_query_indexes(c):
+    # Worker 全量加载 / 执行前校验 (status=1)、增量同步 (updated_at)
+    _add_index(c, "tasks", "idx_tasks_status", "status")
+    _add_index(c, "tasks", "idx_tasks_updated_at", "updated_at")
+    # 前台任务列表 (按用户、创建时间倒序分页)
+    _add_index(c, "tasks", "idx_tasks_user_created", "username, created_at")
+    # 旧版限流的窗口统计与过期清理
+    _add_index(c, "request_logs", "idx_request_logs_time", "req_time")
+
+
+def _v3_route_leases(c):
+    # 线路租约：多个 Worker 并行时，每条线路同一时刻只由一个 Worker 查询
+    c.execute('''CREATE TABLE IF NOT EXISTS route_leases (
+                    route_key VARCHAR(255) PRIMARY KEY,  -- 出发|到达|日期|中转站
+                    owner VARCHAR(128) NOT NULL DEFAULT '',  -- 持有者 (Worker 标识)，空为无人持有
+                    lease_until DOUBLE NOT NULL DEFAULT 0  -- 到期时刻 (数据库时钟，秒)
+                )''')
+
+
+def _v4_notify_entries(c):
+    # notify_digest 由 16 位整体摘要改存逐项的 "车次席别摘要:余票档位"，用于判断新增车次/席别与档位上升
+    backend.widen_column(c, "tasks", "notify_digest", "TEXT")
+
+
+def _v5_worker_coordination(c):
+    # 多机部署：在线 Worker 的心跳，按主机数放大轮询预算
+    c.execute('''CREATE TABLE IF NOT EXISTS worker_heartbeats (
+                    owner VARCHAR(128) PRIMARY KEY,  -- Worker 标识
+                    host VARCHAR(128) NOT NULL,  -- 所在主机 (同一出口 IP 共用一份请求预算)
+                    seen_until DOUBLE NOT NULL DEFAULT 0  -- 心跳有效期 (数据库时钟，秒)
+                )''')
+    # 同机多 Worker 共用的请求节拍：下一个可用时间槽记在共享令牌桶那一行
+    _add_column(c, "rate_buckets", "next_slot", "DOUBLE NOT NULL DEFAULT 0")
+
+
+MIGRATIONS = [
+    (1, "基础表结构", _v1_base_tables),
+    (2, "热点查询索引", _v2_hot_query_indexes),
+    (3, "线路租约", _v3_route_leases),
+    (4, "通知余票条目", _v4_notify_entries),
+    (5, "Worker 心跳与共享节拍", _v5_worker_coordination),
+]
+
+
+# ================= 执行 =================
+
+def current_version():
+    """已应用的最高版本号 (未初始化过返回 0)"""
+    with db_cursor() as c:
+        c.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                        version INT PRIMARY KEY,
+                        description VARCHAR(255),
+                        applied_at DATETIME
+                    )''')
+        c.execute("SELECT MAX(version) FROM schema_version")
+        return c.fetchone()[0] or 0
+
+
+def migrate():
+    """执行所有未应用的迁移，返回本次执行的版本列表；已是最新时只有一次版本查询"""
+    if current_version() >= MIGRATIONS[-1][0]:
+        return []
+
+    applied = []
+    with db_cursor(locking=True) as c:
+        backend.lock(c, MIGRATE_LOCK, 60)
+        try:
+            # 拿到锁之后重新读版本，别的进程可能刚执行完
+            c.execute("SELECT version FROM schema_version")
+            done = {row[0] for row in c.fetchall()}
+            for version, description, step in MIGRATIONS:
+                if version in done:
+                    continue
+                step(c)
+                c.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)",
+                          (version, description, datetime.now()))
+                if not backend.transactional_ddl:
+                    # MySQL 的 DDL 会隐式提交：逐个版本提交版本记录 (SQLite 全部迁移在同一个事务里)
+                    c.connection.commit()
+                applied.append(version)
+                print(f"✅ 数据库迁移 v{version} ({description}) 已完成")
+        finally:
+            backend.unlock(c, MIGRATE_LOCK)
+    return applied
+
+
+def init_db():
+    """进程启动时调用：迁移到最新结构，失败只打印提示，不阻止进程启动 (与原 init_db 行为一致)"""
+    try:
+        migrate()
+        print(f"✅ 数据库表结构已是最新 ({backend.name})")
+    except Exception as e:
+        print(f"❌ 数据库连接失败，请检查配置: {e}")
+
+
+if __name__ == "__main__":
+    init_db()
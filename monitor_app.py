@@ -1,14 +1,23 @@
 import streamlit as st
 import database as db
-from datetime import datetime, timedelta
-import requests
+from datetime import datetime, timedelta, time as dt_time
 import re
 import time
 import ticket_core  # 引入核心库，用于立即查询
+from station_index import station_index
+from migrations import init_db
+from poll_policy import POLL_POLICY_CONFIG, proximity_weight
 
 # ================= 基础配置 =================
 st.set_page_config(page_title="12306 云监控服务", page_icon="🚄", layout="wide")
 
+@st.cache_resource
+def ensure_schema():
+    """每个 Streamlit 进程只检查一次表结构版本 (导入 database 不再自动建表)"""
+    init_db()
+
+ensure_schema()
+
 # --- 弹窗逻辑 ---
 @st.dialog("⚠️ 特别声明")
 def show_disclaimer():
@@ -30,21 +39,37 @@ def show_disclaimer():
 if "has_seen_disclaimer" not in st.session_state:
     show_disclaimer()
 
-STATION_JS_URL = "https://kyfw.12306.cn/otn/resources/js/framework/station_name.js"
-HEADERS = {"User-Agent": "Mozilla/5.0"}
-
-@st.cache_data
-def get_stations():
-    try:
-        res = requests.get(STATION_JS_URL, headers=HEADERS)
-        res.encoding = 'utf-8'
-        stations = {}
-        for part in res.text.split('@'):
-            if not part: continue
-            infos = part.split('|')
-            if len(infos) > 2: stations[infos[1]] = infos[2]
-        return stations
-    except Exception: return {}
+def station_select(container, label, key, default=None, index=0):
+    """车站下拉框：显示文本附带全拼/简拼，输入 beijing 或 bj 也能过滤到北京"""
+    names = station_index.names()
+    if default in station_index:
+        index = names.index(default)
+    return container.selectbox(label, names, index=index, format_func=station_index.label, key=key)
+
+TASK_PAGE_SIZE = 10
+TASK_LIST_TTL = 30  # 任务列表缓存秒数：后台 Worker 更新的检查时间/状态最多延迟这么久显示
+TASK_STATUS_FILTERS = {"监控中": 1, "已抢到": 2, "已停止": 0, "全部": None}
+
+@st.cache_resource
+def _task_list_versions():
+    """每个用户的任务列表版本号 (进程内所有会话共享)，增删任务时加一，使缓存失效"""
+    return {}
+
+def invalidate_task_list(username):
+    versions = _task_list_versions()
+    versions[username] = versions.get(username, 0) + 1
+
+@st.cache_data(ttl=TASK_LIST_TTL, max_entries=1000)
+def load_task_page(username, status, page, version):
+    """缓存一页任务；version 只参与缓存键，增删任务后自然换一个键"""
+    return db.get_user_tasks_page(username, status, page, TASK_PAGE_SIZE)
+
+def time_window_input(container, label, key):
+    """时间段滑块，选满全天时返回 None (不限)，否则返回 'HH:MM-HH:MM'"""
+    lo, hi = container.slider(label, value=(dt_time(0, 0), dt_time(23, 59)), step=timedelta(minutes=30), format="HH:mm", key=key)
+    if lo == dt_time(0, 0) and hi >= dt_time(23, 30):
+        return None
+    return f"{lo.strftime('%H:%M')}-{hi.strftime('%H:%M')}"
 
 # ================= 登录/注册逻辑 =================
 if 'user' not in st.session_state:
@@ -84,8 +109,9 @@ def main_dashboard():
         st.session_state.user = None
         st.rerun()
     
-    stations = get_stations()
-    if not stations: st.error("无法加载车站数据"); return
+    # 车站索引读本地文件；首次部署时同步下载一次，失败后由索引按退避时间在后台重试 (这里不再同步下载，免得每次刷新页面都卡住)
+    if not len(station_index):
+        st.error("无法加载车站数据，后台会稍后自动重试，请过几分钟再刷新"); return
 
     st.title("🚄 任务管理看板")
     
@@ -98,23 +124,31 @@ def main_dashboard():
         # === 直达监控 Tab ===
         with tab_direct:
             c1, c2, c3 = st.columns(3)
-            f_city = c1.selectbox("出发地", list(stations.keys()), index=list(stations.keys()).index("南昌") if "南昌" in stations else 0, key="d_f")
-            t_city = c2.selectbox("目的地", list(stations.keys()), index=list(stations.keys()).index("邯郸") if "邯郸" in stations else 0, key="d_t")
+            f_city = station_select(c1, "出发地", key="d_f", default="南昌")
+            t_city = station_select(c2, "目的地", key="d_t", default="邯郸")
             date_obj = c3.date_input("出发日期", min_value=datetime.today(), key="d_date")
             
             c4, c5 = st.columns(2)
             train_types = c4.multiselect("车型", ["高铁(G/C)", "动车(D)", "普速(Z/T/K)"], default=["高铁(G/C)", "动车(D)", "普速(Z/T/K)"], key="d_tt")
             seat_types = c5.multiselect("目标席别", ["二等", "一等", "商务", "硬卧", "软卧", "硬座", "无座"], default=["二等", "硬卧"], key="d_st")
             
+            c6, c7, c8 = st.columns(3)
+            d_codes = c6.text_input("指定车次 (可选，逗号分隔)", placeholder="如 G1234,D5678", key="d_codes")
+            d_depart = time_window_input(c7, "发车时间段", key="d_dw")
+            d_arrive = time_window_input(c8, "到达时间段", key="d_aw")
+            
             recv_email = st.text_input("接收通知邮箱", value=st.session_state.email, key="d_email")
             
             if st.button("🚀 提交直达任务", type="primary"):
                 if not train_types or not seat_types:
                     st.error("请至少选择一种车型和席别")
                 else:
-                    db.add_task(st.session_state.user, stations[f_city], stations[t_city], 
+                    codes = ",".join(c.strip().upper() for c in d_codes.replace("，", ",").split(",") if c.strip())
+                    db.add_task(st.session_state.user, station_index.code_of(f_city), station_index.code_of(t_city), 
                                date_obj.strftime("%Y-%m-%d"), 
-                               ",".join(train_types), ",".join(seat_types), recv_email)
+                               ",".join(train_types), ",".join(seat_types), recv_email,
+                               train_codes=codes or None, depart_window=d_depart, arrive_window=d_arrive)
+                    invalidate_task_list(st.session_state.user)
                     st.success("✅ 直达任务已保存！")
                     time.sleep(1)
                     st.rerun()
@@ -122,15 +156,19 @@ def main_dashboard():
         # === 中转监控 Tab ===
         with tab_transfer:
             c1, c2, c3, c4 = st.columns(4)
-            tf_f = c1.selectbox("出发地", list(stations.keys()), index=0, key="t_f")
-            tf_m = c2.selectbox("中转地", list(stations.keys()), index=list(stations.keys()).index("武汉") if "武汉" in stations else 0, key="t_m")
-            tf_t = c3.selectbox("目的地", list(stations.keys()), index=1, key="t_t")
+            tf_f = station_select(c1, "出发地", key="t_f")
+            tf_m = station_select(c2, "中转地", key="t_m", default="武汉")
+            tf_t = station_select(c3, "目的地", key="t_t", index=1)
             tf_date = c4.date_input("出发日期", min_value=datetime.today(), key="t_date")
 
             c5, c6 = st.columns(2)
             tf_tt = c5.multiselect("车型", ["高铁(G/C)", "动车(D)", "普速(Z/T/K)"], default=["高铁(G/C)", "动车(D)"], key="t_tt")
             tf_st = c6.multiselect("目标席别", ["二等", "一等", "硬卧"], default=["二等"], key="t_st")
             
+            c7, c8 = st.columns(2)
+            tf_depart = time_window_input(c7, "首程发车时间段", key="t_dw")
+            tf_arrive = time_window_input(c8, "末程到达时间段", key="t_aw")
+            
             tf_email = st.text_input("接收通知邮箱", value=st.session_state.email, key="t_email")
 
             if st.button("🚀 提交中转任务", type="primary"):
@@ -140,50 +178,52 @@ def main_dashboard():
                     st.error("出发、中转、目的站不能相同")
                 else:
                     # 存入数据库，传入 middle_station
-                    db.add_task(st.session_state.user, stations[tf_f], stations[tf_t], 
+                    db.add_task(st.session_state.user, station_index.code_of(tf_f), station_index.code_of(tf_t), 
                                tf_date.strftime("%Y-%m-%d"), 
                                ",".join(tf_tt), ",".join(tf_st), tf_email, 
-                               middle_st=stations[tf_m])
+                               middle_st=station_index.code_of(tf_m), depart_window=tf_depart, arrive_window=tf_arrive)
+                    invalidate_task_list(st.session_state.user)
                     st.success("✅ 中转任务已保存！后台将自动轮询双程票。")
                     time.sleep(1)
                     st.rerun()
 
     # --- 我的任务列表 ---
-    col_t1, col_t2 = st.columns([4, 1])
+    col_t1, col_t2, col_t3 = st.columns([3, 1, 1])
     with col_t1:
-        st.markdown("### 📋 正在运行的任务")
+        st.markdown("### 📋 我的任务")
     with col_t2:
+        status_label = st.selectbox("状态", list(TASK_STATUS_FILTERS), label_visibility="collapsed", key="task_status",
+                                    on_change=lambda: st.session_state.update(task_page=1))
+    with col_t3:
         if st.button("🔄 刷新状态"):
+            invalidate_task_list(st.session_state.user)
             st.rerun()
 
-    tasks = db.get_user_tasks(st.session_state.user)
+    # 只查当前页 (服务端分页 + 状态筛选)，结果按用户缓存，界面交互不再每次查库
+    username = st.session_state.user
+    page = st.session_state.get("task_page", 1)
+    tasks, total = load_task_page(username, TASK_STATUS_FILTERS[status_label], page,
+                                  _task_list_versions().get(username, 0))
+    pages = max(1, -(-total // TASK_PAGE_SIZE))
+    if page > pages:
+        # 删除任务或切换筛选后页码越界，回到最后一页
+        st.session_state.task_page = pages
+        st.rerun()
     
     if not tasks:
-        st.info("暂无任务，快去添加一个吧！")
+        st.info("暂无任务，快去添加一个吧！" if status_label == "全部" else f"暂无{status_label}的任务")
     else:
         for task in tasks:
-            # 解包任务元组
-            # 兼容性处理：数据库可能有12或13个字段 (取决于 middle_station 是否在最后)
-            # 假设顺序: id, user, f, t, date, tt, st, email, status, created, last_check, last_notify, [middle]
-            t_id = task[0]
-            f_st_code = task[2]
-            t_st_code = task[3]
-            date_str = task[4]
-            seat_str = task[6]
-            status = task[8]
-            
-            # 尝试获取 middle_station (假设它是第13个字段，索引12)
-            middle_st_code = None
-            if len(task) > 12:
-                middle_st_code = task[12]
-
-            # 车站代码转中文
-            try:
-                f_name = [k for k,v in stations.items() if v==f_st_code][0]
-                t_name = [k for k,v in stations.items() if v==t_st_code][0]
-                m_name = [k for k,v in stations.items() if v==middle_st_code][0] if middle_st_code else None
-            except:
-                f_name, t_name, m_name = f_st_code, t_st_code, middle_st_code
+            # 任务行为 db.TaskListItem，按列名取值
+            t_id = task.id
+            date_str = task.date_str
+            seat_str = task.seat_types
+            status = task.status
+
+            # 车站代码转中文 (字典直查，找不到时显示代码)
+            f_name = station_index.name_of(task.from_station)
+            t_name = station_index.name_of(task.to_station)
+            m_name = station_index.name_of(task.middle_station)
 
             status_text = "🟢 监控中" if status == 1 else ("🔴 已停止" if status == 0 else "🎉 已抢到")
             
@@ -202,36 +242,34 @@ def main_dashboard():
                 col3.markdown(f"{status_text}")
                 if col4.button("🗑️ 删除", key=f"del_{t_id}"):
                     db.delete_task(t_id)
+                    invalidate_task_list(username)
                     st.rerun()
                 
                 # --- 状态详情栏 ---
-                # 解析时间字段
-                # 假设 last_check 是第10个(index 10), last_notify 是第11个(index 11)
-                # 再次强调：这里依赖数据库查询返回的顺序
-                try:
-                    l_check = task[10]
-                    l_notify = task[11]
-                    if isinstance(l_check, str): l_check = datetime.strptime(l_check, "%Y-%m-%d %H:%M:%S")
-                    if isinstance(l_notify, str): l_notify = datetime.strptime(l_notify, "%Y-%m-%d %H:%M:%S")
-                except:
-                    l_check, l_notify = None, None
+                # 时间字段已是原生 datetime (见 database._make_rows)
+                l_check = task.last_check_time
+                l_notify = task.last_notification_time
 
                 # 计算状态
                 now = datetime.now()
                 info_msg = ""
                 
-                # 1. 冷却判断
+                # 1. 冷却判断 (冷却期内照常轮询，只有余票无变化时不重复提醒)
                 if l_notify and (now - l_notify < timedelta(hours=3)):
                     recover_time = l_notify + timedelta(hours=3)
-                    info_msg = f"❄️ **已发现余票，暂停打扰** (冷却至 {recover_time.strftime('%H:%M')})"
+                    info_msg = f"❄️ **已发现余票并通知** (余票无变化时 {recover_time.strftime('%H:%M')} 前不再重复提醒，有新余票会立即通知)"
                     st.warning(info_msg, icon="❄️")
                 
                 # 2. 常规轮询判断
-                elif status == 1:
+                if status == 1:
                     if not l_check:
                         st.info("⏳ **新任务加入队列，等待后台首次扫描...**", icon="🚀")
                     else:
-                        next_run = l_check + timedelta(minutes=10) # 10分钟轮询间隔
+                        # 轮询间隔由后台按发车临近程度、订阅人数与余票波动调整，这里只按发车日期粗略估算
+                        weight = proximity_weight(date_str)
+                        interval = POLL_POLICY_CONFIG["base_interval"] / weight if weight else POLL_POLICY_CONFIG["max_interval"]
+                        interval = min(POLL_POLICY_CONFIG["max_interval"], max(POLL_POLICY_CONFIG["min_interval"], interval))
+                        next_run = l_check + timedelta(seconds=interval)
                         # 如果下次运行时间已经过了，说明马上就要跑了
                         if next_run < now:
                             next_str = "马上执行"
@@ -242,6 +280,12 @@ def main_dashboard():
                 
                 st.divider()
 
+    # --- 翻页 ---
+    if pages > 1:
+        c_p1, c_p2 = st.columns([1, 4])
+        c_p1.number_input("页码", min_value=1, max_value=pages, step=1, key="task_page", label_visibility="collapsed")
+        c_p2.caption(f"第 {page} / {pages} 页，共 {total} 个任务")
+
 if st.session_state.user:
     main_dashboard()
 else:
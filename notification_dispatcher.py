@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+import database as db
+from smtp_pool import smtp_pool
+from email_templates import generate_email_html, generate_digest_html
+from migrations import init_db
+import metrics
+from logutil import log
+
+load_dotenv()
+
+# ================= 配置区 =================
+DISPATCH_CONFIG = {
+    "batch_size": int(os.getenv("OUTBOX_BATCH_SIZE") or 50),  # 每次领取的收件人数 (每人合并为一封邮件)
+    "digest_window": float(os.getenv("OUTBOX_DIGEST_SECONDS") or 30),  # 汇总窗口：收件人最早的通知等待该秒数，攒齐同一轮其它线路的命中
+    "poll_interval": float(os.getenv("OUTBOX_POLL_SECONDS") or 2),  # 发件箱为空时的轮询间隔
+    "lease_seconds": 120,  # 领取后的租约，进程崩溃时到期重新领取
+    "max_attempts": int(os.getenv("OUTBOX_MAX_ATTEMPTS") or 5),  # 超过该次数放弃
+    "backoff_seconds": 30,  # 重试退避基数：30s, 60s, 120s ...
+    "retention_days": int(os.getenv("OUTBOX_RETENTION_DAYS") or 7),  # 已发送/已放弃的通知保留天数
+    "prune_interval": 3600  # 多久清理一次过期的通知
+}
+
+
+def notification_kind(row):
+    """指标标签：中转方案为 transfer，直达为 direct"""
+    return "transfer" if row[5] else "direct"
+
+
+def compose(rows):
+    """同一收件人的通知 -> (标题, HTML 正文)：只有一条时沿用原来的单条邮件，多条合并为汇总邮件"""
+    if len(rows) == 1:
+        _, _, _, subject, tickets_html, is_transfer, _ = rows[0]
+        return subject, generate_email_html(tickets_html, is_transfer)
+    sections = [(subject, tickets_html) for _, _, _, subject, tickets_html, _, _ in rows]
+    return f"[余票汇总] {len(rows)} 条监控有新余票", generate_digest_html(sections)
+
+
+def dispatch_once():
+    """按收件人领取一批通知，每人合并成一封邮件发送 (send_many 在连接池上并发)，返回本批收件人数"""
+    rows = db.claim_notifications(DISPATCH_CONFIG["batch_size"], DISPATCH_CONFIG["lease_seconds"],
+                                  DISPATCH_CONFIG["digest_window"])
+    if not rows:
+        return 0
+
+    # 按收件人分组，同一任务只保留最新的一条 (行按 id 升序)：重试中的旧通知余票已过时，随新通知一起标记为已发送
+    by_email, superseded = {}, []
+    for row in rows:
+        by_task = by_email.setdefault(row[2], {})
+        if row[1] in by_task:
+            superseded.append(by_task[row[1]])
+        by_task[row[1]] = row
+    groups = {email: list(by_task.values()) for email, by_task in by_email.items()}
+    results = smtp_pool.send_many([(email, *compose(group)) for email, group in groups.items()])
+
+    sent_ids = [row[0] for row in superseded]
+    for row in superseded:
+        metrics.NOTIFICATIONS.inc(kind=notification_kind(row), result="superseded")
+    for (email, group), ok in zip(groups.items(), results):
+        task_ids = ",".join(str(row[1]) for row in group)
+        if ok:
+            sent_ids.extend(row[0] for row in group)
+            for row in group:
+                metrics.NOTIFICATIONS.inc(kind=notification_kind(row), result="sent")
+            log(f"✅ 通知发送成功: {email} (任务 {task_ids})")
+            continue
+        # 发送失败：每条通知按自己的尝试次数退避或放弃，下次可能与新的命中重新组合
+        for row in group:
+            outbox_id, task_id, _, _, _, _, attempts = row
+            gave_up = attempts >= DISPATCH_CONFIG["max_attempts"]
+            metrics.NOTIFICATIONS.inc(kind=notification_kind(row), result="gave_up" if gave_up else "retry")
+            if gave_up:
+                db.mark_notification_failed(outbox_id, f"连续 {attempts} 次发送失败")
+                log(f"❌ 通知放弃发送: {email} (任务 {task_id}, 已尝试 {attempts} 次)")
+            else:
+                retry_at = datetime.now() + timedelta(seconds=DISPATCH_CONFIG["backoff_seconds"] * 2 ** (attempts - 1))
+                db.mark_notification_failed(outbox_id, "SMTP 发送失败", retry_at)
+                log(f"⚠️ 通知发送失败，{retry_at.strftime('%H:%M:%S')} 重试: {email} (任务 {task_id})")
+    db.mark_notifications_sent(sent_ids)
+    return len(groups)
+
+
+def prune_outbox():
+    """清理超过保留天数的已发送/已放弃通知 (否则发件箱与其索引会无限增长)；失败只记录日志，下次再试"""
+    try:
+        deleted = db.prune_outbox(DISPATCH_CONFIG["retention_days"])
+    except Exception as e:
+        log(f"⚠️ 清理发件箱失败: {e}")
+        return
+    if deleted:
+        log(f"🧹 已清理 {deleted} 条 {DISPATCH_CONFIG['retention_days']} 天前的通知")
+
+
+def dispatcher_loop(stop_event=None):
+    """发件箱主循环；stop_event 被设置后返回 (仿真/测试用)"""
+    log("📮 通知发送服务已启动...")
+    init_db()
+    metrics.start_http_server()
+    prune_at = 0.0  # 下次清理发件箱的 monotonic 时间 (启动时先清理一次)
+
+    while not (stop_event and stop_event.is_set()):
+        if time.monotonic() >= prune_at:
+            prune_at = time.monotonic() + DISPATCH_CONFIG["prune_interval"]
+            prune_outbox()
+        try:
+            count = dispatch_once()
+        except Exception as e:
+            log(f"❌ 发件箱处理错误: {e}")
+            count, wait_seconds = 0, 5
+        else:
+            wait_seconds = DISPATCH_CONFIG["poll_interval"]
+
+        if count < DISPATCH_CONFIG["batch_size"]:
+            # 发件箱已取空，稍后再来；满批说明还有积压，立即继续
+            if stop_event:
+                stop_event.wait(wait_seconds)
+            else:
+                time.sleep(wait_seconds)
+
+
+if __name__ == "__main__":
+    dispatcher_loop()
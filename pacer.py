@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+import threading
+import time
+from dotenv import load_dotenv
+import database as db
+from rate_limiter import RATE_LIMIT_CONFIG
+
+load_dotenv()
+
+# 相邻两次 12306 请求的最小间隔与随机抖动 (秒)，即 2~5 秒一次
+# 节拍与限流共用后端：限流用共享令牌桶时 (同机多 Worker)，节拍也记在同一行里，多个进程合起来仍保持间隔
+PACER_CONFIG = {
+    "min_interval": float(os.getenv("PACER_MIN_INTERVAL") or 2.0),
+    "jitter": float(os.getenv("PACER_JITTER") or 3.0),
+    "backend": RATE_LIMIT_CONFIG["backend"],
+    "name": RATE_LIMIT_CONFIG["name"]
+}
+
+
+class Pacer:
+    """
+    全局请求节拍器 (线程安全)
+    所有线程发请求前先 wait()：在锁内预约下一个时间槽，锁外睡到该时刻，
+    保证整个进程对 12306 的请求间隔 >= min_interval + 随机抖动，而不是每个线程各睡各的
+    """
+
+    def __init__(self, min_interval, jitter):
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        """阻塞到本线程的请求时间槽，返回实际等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.min_interval + random.uniform(0, self.jitter)
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+class DatabasePacer(Pacer):
+    """
+    跨进程的节拍器：下一个时间槽记在共享令牌桶那一行 (rate_buckets.next_slot，数据库时钟)
+    在行锁内预约时间槽，同一台机器上的多个 Worker 合起来的请求间隔仍 >= min_interval + 随机抖动
+    """
+
+    def __init__(self, min_interval, jitter, name):
+        super().__init__(min_interval, jitter)
+        self.name = name
+
+    def wait(self):
+        sql = f"SELECT next_slot, {db.backend.now_epoch} FROM rate_buckets WHERE name=%s{db.backend.for_update}"
+        with db.db_cursor(locking=True) as c:
+            c.execute(sql, (self.name,))
+            row = c.fetchone()
+            if row is None:
+                # 令牌桶还没建行：updated_at=0，限流器首次取令牌时按满桶计算
+                c.execute(f"{db.backend.insert_ignore} INTO rate_buckets (name, tokens, updated_at, next_slot) VALUES (%s, 0, 0, 0)",
+                          (self.name,))
+                c.execute(sql, (self.name,))
+                row = c.fetchone()
+            next_slot, now = (float(v) for v in row)
+            slot = max(now, next_slot)
+            c.execute("UPDATE rate_buckets SET next_slot=%s WHERE name=%s",
+                      (slot + self.min_interval + random.uniform(0, self.jitter), self.name))
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+
+def create_pacer(config=PACER_CONFIG):
+    if config["backend"] in ("database", "mysql"):
+        return DatabasePacer(config["min_interval"], config["jitter"], config["name"])
+    return Pacer(config["min_interval"], config["jitter"])
+
+
+# 进程内共享的节拍器
+request_pacer = create_pacer()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+from datetime import datetime, date as date_cls
+from dotenv import load_dotenv
+from rate_limiter import RATE_LIMIT_CONFIG
+from change_detector import change_detector
+
+load_dotenv()
+
+POLL_POLICY_CONFIG = {
+    "base_interval": float(os.getenv("POLL_BASE_SECONDS") or 600),  # 权重为 1 的线路的轮询间隔 (原来固定的 10 分钟)
+    "min_interval": float(os.getenv("POLL_MIN_SECONDS") or 120),  # 最热的线路也不会比这更频繁
+    "max_interval": float(os.getenv("POLL_MAX_SECONDS") or 1800),  # 最冷的线路也不会比这更稀疏
+    # 轮询最多占用的请求预算比例，余量留给限流后的重试与前台的立即查询
+    "budget_ratio": float(os.getenv("POLL_BUDGET_RATIO") or 0.8)
+}
+
+
+def proximity_weight(date_str, today=None):
+    """发车越近权重越高：明天及以内 x4，3 天内 x2，一周内 x1，更远 x0.5；日期已过 x0 (按最长间隔轮询)"""
+    try:
+        travel_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return 1.0
+    days = (travel_date - (today or date_cls.today())).days
+    if days < 0:
+        return 0.0
+    if days <= 1:
+        return 4.0
+    if days <= 3:
+        return 2.0
+    if days <= 7:
+        return 1.0
+    return 0.5
+
+
+def subscriber_weight(count):
+    """订阅人数越多权重越高，但边际递减：1 人 x1，2 人 x2，4 人 x3，8 人 x4 ..."""
+    return 1.0 + math.log2(max(count, 1))
+
+
+def volatility_weight(volatility):
+    """余票快照变化越频繁越值得多看：从不变化 x0.5，每次都变 x2；还没有观测时 x1"""
+    if volatility is None:
+        return 1.0
+    return 0.5 + 1.5 * volatility
+
+
+class PollPolicy:
+    """
+    自适应轮询策略：每条线路按 发车临近程度 × 订阅人数 × 余票波动 得到权重，间隔与权重成反比
+    间隔系数按全局请求预算统一收紧：所有线路的预计请求速率之和不超过 12306 请求预算
+    (预算宽裕时权重为 1 的线路仍是 base_interval，不会因为有余量就把所有线路都拉到最快)
+    多机部署时每台主机 (出口 IP) 各有一份预算，全部线路由在线主机分担，总预算按主机数放大 (见 set_hosts)
+    """
+
+    def __init__(self, config=None, budget_per_minute=None, detector=change_detector):
+        self.config = config or POLL_POLICY_CONFIG
+        if budget_per_minute is None:
+            budget_per_minute = RATE_LIMIT_CONFIG["rate_per_minute"]
+        self.host_budget = budget_per_minute / 60 * self.config["budget_ratio"]  # 单台主机每秒可用请求数
+        self.hosts = 1
+        self.budget = self.host_budget  # 所有在线主机合计
+        self.detector = detector
+        self._intervals = {}  # route_key -> 轮询间隔 (秒)
+        self.scale = self.config["base_interval"]
+
+    def set_hosts(self, hosts):
+        """在线主机数变化时放大/缩小总预算，返回是否有变化 (有变化需要 rebalance)"""
+        hosts = max(1, int(hosts))
+        if hosts == self.hosts:
+            return False
+        self.hosts = hosts
+        self.budget = self.host_budget * hosts
+        return True
+
+    def weight(self, route_key, subscribers, today=None):
+        return (proximity_weight(route_key[2], today)
+                * subscriber_weight(subscribers)
+                * volatility_weight(self.detector.volatility(route_key)))
+
+    @staticmethod
+    def request_cost(route_key):
+        """每轮询一次的请求数：中转查两程 (缓存命中时更少，这里按上限估算)"""
+        return 2 if route_key[3] else 1
+
+    def rebalance(self, routes, today=None):
+        """
+        routes 为 {route_key: 订阅任务数}，重新计算每条线路的间隔，返回间隔有变化的线路
+        间隔 = scale / 权重 (限制在 [min_interval, max_interval])，scale 取 base_interval 与 "刚好用满预算" 两者中较大的
+        """
+        cfg = self.config
+        weights = {key: self.weight(key, count, today) for key, count in routes.items()}
+        demand = sum(self.request_cost(key) * w for key, w in weights.items())
+        self.scale = max(cfg["base_interval"], demand / self.budget if self.budget > 0 else 0.0)
+
+        intervals = {}
+        for key, w in weights.items():
+            interval = cfg["max_interval"] if w <= 0 else self.scale / w
+            intervals[key] = min(cfg["max_interval"], max(cfg["min_interval"], interval))
+
+        # 最长间隔的上限会把冷门线路拉快；线路太多时整体等比放慢，保证不超预算
+        rate = sum(self.request_cost(key) / interval for key, interval in intervals.items())
+        if self.budget > 0 and rate > self.budget:
+            stretch = rate / self.budget
+            intervals = {key: interval * stretch for key, interval in intervals.items()}
+
+        changed = [key for key, interval in intervals.items() if self._intervals.get(key) != interval]
+        gone = self._intervals.keys() - intervals.keys()
+        if gone:
+            self.detector.forget(gone)
+        self._intervals = intervals
+        return changed
+
+    def interval(self, route_key):
+        return self._intervals.get(route_key, self.config["base_interval"])
+
+    def expected_rate(self):
+        """当前分配下的预计请求速率 (次/分钟)，用于日志"""
+        return sum(self.request_cost(key) / interval for key, interval in self._intervals.items()) * 60
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import time
+from dotenv import load_dotenv
+import database as db
+
+load_dotenv()
+
+# ================= 限流配置 =================
+# backend: memory = 进程内令牌桶 (单进程)；database = 共享令牌桶 (多进程/多机共用数据库里的一行记录，旧配置写作 mysql)
+RATE_LIMIT_CONFIG = {
+    "backend": os.getenv("RATE_LIMIT_BACKEND") or "memory",
+    "rate_per_minute": float(os.getenv("RATE_LIMIT_PER_MINUTE") or 2),  # 每分钟补充的令牌数 (即 12306 请求预算)
+    "burst": float(os.getenv("RATE_LIMIT_BURST") or 4),  # 桶容量：每程查询 1 个令牌，允许短时间内连续查询的程数
+    "name": os.getenv("RATE_LIMIT_NAME") or "12306"  # 共享桶的名字
+}
+
+
+class RateLimiter:
+    """令牌桶限流器基类：子类实现 _try_take(cost)，成功返回 0，否则返回还需等待的秒数"""
+
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60.0  # 每秒补充的令牌
+        self.capacity = burst
+
+    def acquire(self, cost=1, timeout=0):
+        """
+        原子地扣除 cost 个令牌
+        timeout=0 时不等待 (拿不到立即返回 False)；否则最多等待 timeout 秒
+        """
+        if cost > self.capacity:
+            raise ValueError(f"cost={cost} 超过桶容量 {self.capacity}")
+        start = time.monotonic()
+        while True:
+            need_wait = self._try_take(cost)
+            if need_wait <= 0:
+                return True
+            if time.monotonic() - start + need_wait > timeout:
+                return False
+            time.sleep(need_wait)
+
+    def _try_take(self, cost):
+        raise NotImplementedError
+
+
+class MemoryTokenBucket(RateLimiter):
+    """进程内令牌桶 (线程安全)"""
+
+    def __init__(self, rate_per_minute, burst):
+        super().__init__(rate_per_minute, burst)
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def _try_take(self, cost):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= cost:
+                self._tokens -= cost
+                return 0.0
+            return (cost - self._tokens) / self.rate
+
+
+class DatabaseTokenBucket(RateLimiter):
+    """
+    共享令牌桶：状态存在 rate_buckets 表的一行里
+    SELECT ... FOR UPDATE 行锁 (SQLite 为整库写锁) + 同一事务内更新，多个进程/机器并发扣减也不会超发；时间取数据库时钟
+    """
+
+    def __init__(self, rate_per_minute, burst, name):
+        super().__init__(rate_per_minute, burst)
+        self.name = name
+
+    def _try_take(self, cost):
+        sql = f"SELECT tokens, updated_at, {db.backend.now_epoch} FROM rate_buckets WHERE name=%s{db.backend.for_update}"
+        with db.db_cursor(locking=True) as c:
+            c.execute(sql, (self.name,))
+            row = c.fetchone()
+            if row is None:
+                # 首次使用：建一个满桶 (并发建行时 IGNORE 掉重复的)
+                c.execute(f"{db.backend.insert_ignore} INTO rate_buckets (name, tokens, updated_at) VALUES (%s, %s, {db.backend.now_epoch})",
+                          (self.name, self.capacity))
+                c.execute(sql, (self.name,))
+                row = c.fetchone()
+            tokens, updated_at, now = (float(v) for v in row)
+            tokens = min(self.capacity, tokens + max(0.0, now - updated_at) * self.rate)
+            if tokens < cost:
+                return (cost - tokens) / self.rate
+            c.execute("UPDATE rate_buckets SET tokens=%s, updated_at=%s WHERE name=%s", (tokens - cost, now, self.name))
+            return 0.0
+
+
+def create_limiter(config=RATE_LIMIT_CONFIG):
+    if config["backend"] in ("database", "mysql"):
+        return DatabaseTokenBucket(config["rate_per_minute"], config["burst"], config["name"])
+    if config["backend"] == "memory":
+        return MemoryTokenBucket(config["rate_per_minute"], config["burst"])
+    raise ValueError(f"未知的限流后端: {config['backend']}")
+
+
+# 进程内共享的 12306 请求限流器
+limiter = create_limiter()
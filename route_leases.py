@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import threading
+import time
+from datetime import date
+from dotenv import load_dotenv
+import database as db
+import metrics
+from logutil import log
+
+load_dotenv()
+
+LEASE_CONFIG = {
+    # 只有多个 Worker 共用一张任务表时才需要租约 (run_server --workers N 会自动开启；多机部署设 ROUTE_LEASES=1)
+    "enabled": (os.getenv("ROUTE_LEASES") or "0") != "0" or int(os.getenv("WORKER_COUNT") or 1) > 1,
+    "owner": os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}",  # 本 Worker 的标识
+    "host": os.getenv("WORKER_HOST") or socket.gethostname(),  # 所在主机：同一出口 IP 的 Worker 共用一份请求预算
+    "ttl": float(os.getenv("ROUTE_LEASE_SECONDS") or 60),  # 租约有效期，Worker 崩溃后最多这么久线路被其它 Worker 接手
+    "busy_retry": float(os.getenv("ROUTE_LEASE_RETRY_SECONDS") or 15),  # 线路被别人持有时，多久后再尝试
+    "prune_interval": 3600,  # 多久清理一次不再需要的租约行
+    "idle_seconds": 86400  # 超过该时长无人领取的租约行视为不再需要
+}
+
+
+class RouteLeases:
+    """
+    线路租约：多个 Worker (可在不同机器上) 共用同一批任务，到期的线路先领租约再查询，
+    同一条线路同一时刻只有一个 Worker 在查；执行期间定期心跳续期，结束后归还
+    Worker 崩溃时租约在 ttl 后过期，由其它 Worker 接手
+    另外登记 Worker 心跳，统计在线主机数 (每台主机一份请求预算，轮询预算按主机数放大)
+    """
+
+    def __init__(self, owner, host, ttl, busy_retry, prune_interval, idle_seconds):
+        self.owner = owner
+        self.host = host
+        self.ttl = ttl
+        self.busy_retry = busy_retry
+        self.prune_interval = prune_interval
+        self.idle_seconds = idle_seconds
+        self._known = set()   # 已确认在租约表里有行的 key
+        self._held = {}       # route_key -> 上次续期的 monotonic 时间
+        self._lock = threading.Lock()
+        self._beat_at = 0.0   # 下次心跳的 monotonic 时间
+        self._prune_at = time.monotonic() + prune_interval  # 启动时不清理，错开同时启动的 Worker
+
+    def claim(self, route_keys):
+        """领取一批线路的租约，返回领到的 route_key 集合 (其余线路正由别的 Worker 执行)"""
+        keys = {db.route_lease_key(route_key): route_key for route_key in route_keys}
+        if not keys:
+            return set()
+        missing = keys.keys() - self._known
+        if missing:
+            db.ensure_route_leases(missing)
+            self._known.update(missing)
+        claimed_keys = set(db.claim_route_leases(keys, self.owner, self.ttl))
+        claimed = {keys[key] for key in claimed_keys}
+        now = time.monotonic()
+        with self._lock:
+            for route_key in claimed:
+                self._held[route_key] = now
+        busy = len(keys) - len(claimed)
+        if busy:
+            metrics.ROUTE_LEASE_BUSY.inc(busy)
+            # 没领到的行也可能是被清理掉了：下次领取前重新确认建行
+            self._known -= keys.keys() - claimed_keys
+        return claimed
+
+    def renew(self):
+        """心跳：持有超过 ttl/3 未续期的租约统一续期 (主循环每轮调用，大多数轮次不访问数据库)"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [route_key for route_key, renewed in self._held.items() if now - renewed > self.ttl / 3]
+        if not stale:
+            return
+        renewed = db.renew_route_leases([db.route_lease_key(route_key) for route_key in stale], self.owner, self.ttl)
+        with self._lock:
+            for route_key in stale:
+                if route_key in self._held:
+                    self._held[route_key] = now
+        if renewed < len(stale):
+            metrics.ROUTE_LEASE_LOST.inc(len(stale) - renewed)
+            log(f"⚠️ {len(stale) - renewed} 个线路租约已过期 (执行超过 {self.ttl:.0f} 秒？)，可能被其它 Worker 重复查询")
+
+    def heartbeat(self):
+        """登记本 Worker 仍在运行 (每 ttl/3 一次)，返回在线主机数；未到时间返回 None"""
+        now = time.monotonic()
+        if now < self._beat_at:
+            return None
+        self._beat_at = now + self.ttl / 3
+        return db.heartbeat_worker(self.owner, self.host, self.ttl)
+
+    def prune(self):
+        """每 prune_interval 清理一次长时间无人领取、或出发日期已过的租约行"""
+        now = time.monotonic()
+        if now < self._prune_at:
+            return
+        self._prune_at = now + self.prune_interval
+        removed = db.prune_route_leases(self.idle_seconds, date.today().strftime("%Y-%m-%d"))
+        if removed:
+            log(f"🧹 已清理 {removed} 个不再需要的线路租约")
+
+    def release(self, route_keys):
+        route_keys = list(route_keys)
+        with self._lock:
+            for route_key in route_keys:
+                self._held.pop(route_key, None)
+        db.release_route_leases([db.route_lease_key(route_key) for route_key in route_keys], self.owner)
+
+    def abandon(self, route_keys):
+        """只在本地放弃 (数据库出错时)：不再续期，租约到期后自然释放，本 Worker 也可随时重新领取"""
+        with self._lock:
+            for route_key in route_keys:
+                self._held.pop(route_key, None)
+
+    def held(self):
+        with self._lock:
+            return list(self._held)
+
+
+def create_leases(config=LEASE_CONFIG):
+    """未开启时返回 None：单 Worker 部署不领租约，每条线路省去领取与归还的两个事务"""
+    if not config["enabled"]:
+        return None
+    return RouteLeases(config["owner"], config["host"], config["ttl"], config["busy_retry"],
+                       config["prune_interval"], config["idle_seconds"])
@@ -1,16 +1,46 @@
+import argparse
+import socket
 import subprocess
 import time
 import sys
 import os
 import signal
+from dotenv import load_dotenv
 
+# 与各子进程读同一份 .env：子进程的环境由这里派生 (如按编号分配指标端口)，.env 里的设置不能在这一层丢掉
+load_dotenv()
 
-def run_services():
+
+def worker_env(index, count, metrics_port):
+    """第 index 个 Worker 的环境变量：各自的指标端口与标识；多 Worker 时开启线路租约，同机共用一个按主机命名的令牌桶"""
+    env = dict(os.environ)
+    host = socket.gethostname()
+    if metrics_port:
+        # Worker 0 沿用 METRICS_PORT，METRICS_PORT+1 留给通知发送进程，其余 Worker 依次往后排
+        env["METRICS_PORT"] = str(metrics_port if index == 0 else metrics_port + 1 + index)
+    else:
+        env["METRICS_PORT"] = "0"
+    # 以实际启动的 Worker 数为准 (--workers 可覆盖 .env 的 WORKER_COUNT)，子进程据此决定是否开启线路租约
+    env["WORKER_COUNT"] = str(count)
+    if count > 1:
+        env["WORKER_ID"] = f"{os.getenv('WORKER_ID') or host}-w{index}"
+        env["ROUTE_LEASES"] = "1"
+        # 同一台机器出口 IP 相同，请求预算与请求间隔必须共享：进程内令牌桶/节拍器换成数据库里按主机命名的共享桶
+        if (os.getenv("RATE_LIMIT_BACKEND") or "memory") == "memory":
+            env["RATE_LIMIT_BACKEND"] = "database"
+            env.setdefault("RATE_LIMIT_NAME", f"12306@{host}")
+    return env
+
+
+def run_services(workers=1):
     print("🚀 正在启动 12306 云监控服务...")
 
     # 获取当前 Python 解释器路径 (兼容 Windows/Linux)
     py_executable = sys.executable
 
+    # 指标端点：Worker 用 METRICS_PORT，通知发送进程用 METRICS_PORT+1 (设为 0 关闭)
+    metrics_port = int(os.getenv("METRICS_PORT") or 9108)
+
     # 1. 启动 Streamlit 前台
     print("---------------------------------------------------------")
     print("👉 启动 Web 前台 (monitor_app.py)...")
@@ -21,27 +51,45 @@ def run_services():
         "--server.port", "8501"
     ])
 
-    # 2. 启动 后台 Worker
-    print("👉 启动 后台守护进程 (backend_worker.py)...")
+    # 2. 启动 后台 Worker (多个 Worker 通过线路租约分担线路，互不重复查询)
+    print(f"👉 启动 后台守护进程 (backend_worker.py) x {workers}...")
     # 使用 sys.executable 启动 worker
-    worker_process = subprocess.Popen([py_executable, "backend_worker.py"])
+    worker_processes = [subprocess.Popen([py_executable, "backend_worker.py"], env=worker_env(i, workers, metrics_port))
+                        for i in range(workers)]
+
+    # 3. 启动 通知发送进程 (从发件箱取邮件发送，与查询互不阻塞)
+    print("👉 启动 通知发送进程 (notification_dispatcher.py)...")
+    dispatcher_process = subprocess.Popen([py_executable, "notification_dispatcher.py"],
+                                          env={**os.environ, "METRICS_PORT": str(metrics_port + 1 if metrics_port else 0)})
+
+    processes = [
+        ("Streamlit 前台", "日志请看 stdout", web_process),
+        *[(f"Worker 后台 #{i}" if workers > 1 else "Worker 后台", "检查 backend_worker.py 是否有错", process)
+          for i, process in enumerate(worker_processes)],
+        ("通知发送进程", "检查 notification_dispatcher.py 是否有错", dispatcher_process),
+    ]
 
     print("---------------------------------------------------------")
     print("✅ 服务已全部启动！")
     print("🌐 访问地址: http://localhost:8501")
+    if metrics_port:
+        print(f"📈 指标端点: http://127.0.0.1:{metrics_port}/metrics (Worker), "
+              f"http://127.0.0.1:{metrics_port + 1}/metrics (通知发送)")
+        for i in range(1, workers):
+            print(f"📈 指标端点: http://127.0.0.1:{metrics_port + 1 + i}/metrics (Worker #{i})")
     print("❌ 按 Ctrl+C 可停止所有服务")
     print("---------------------------------------------------------")
 
     try:
-        while True:
+        running = True
+        while running:
             time.sleep(2)
             # 检查子进程状态
-            if web_process.poll() is not None:
-                print("⚠️ Streamlit 前台意外停止！日志请看 stdout")
-                break
-            if worker_process.poll() is not None:
-                print("⚠️ Worker 后台意外停止！检查 backend_worker.py 是否有错")
-                break
+            for name, hint, process in processes:
+                if process.poll() is not None:
+                    print(f"⚠️ {name}意外停止！{hint}")
+                    running = False
+                    break
 
     except KeyboardInterrupt:
         print("\n🛑 收到停止信号...")
@@ -49,21 +97,22 @@ def run_services():
     finally:
         print("🧹 正在清理进程...")
         # 无论如何退出，都要清理子进程
-        if web_process.poll() is None:
-            web_process.terminate()
-        if worker_process.poll() is None:
-            worker_process.terminate()
+        for _, _, process in processes:
+            if process.poll() is None:
+                process.terminate()
 
         # 等待进程平稳退出
-        try:
-            web_process.wait(timeout=5)
-            worker_process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
-            web_process.kill()
-            worker_process.kill()
+        for _, _, process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
 
         print("👋 服务已停止。")
 
 
 if __name__ == "__main__":
-    run_services()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="启动 Web 前台、后台 Worker 与通知发送进程")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKER_COUNT") or 1),
+                        help="本机启动的 Worker 数 (默认读取 WORKER_COUNT，多台机器各自运行即可横向扩展)")
+    run_services(max(1, parser.parse_args().workers))
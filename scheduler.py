@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+import time
+from datetime import datetime, timedelta
+import database as db
+
+# 增量同步的回看秒数：DATETIME 只精确到秒，且事务提交可能晚于 updated_at 的取值时刻，
+# 稍微回看一点，重复读到的行按 id 覆盖即可 (幂等)
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class TaskScheduler:
+    """
+    内存调度器：以线路的下次到期时间为键的小顶堆
+    任务到期时间 = 上次检查 + 线路的轮询间隔 (由 poll_policy 按发车临近、订阅人数与余票波动分配)，
+    线路到期时间取组内最早的任务
+    (通知后的冷却不再暂停轮询：新出的余票要立即通知，重复提醒由 change_detector 控制)
+    多个 Worker 并行时 (leases 不为空)，到期线路先领租约，领不到的说明别的 Worker 正在查，稍后再看
+    """
+
+    def __init__(self, policy, leases=None):
+        self.policy = policy
+        self.leases = leases
+        self._tasks = {}          # task_id -> 任务行 (db.WorkerTask)
+        self._task_last = {}      # task_id -> 上次检查的时间戳 (从未检查为 None)
+        self._routes = {}         # route_key -> {task_id}
+        self._route_due = {}      # route_key -> 堆中有效条目的到期时间 (惰性删除，对不上的条目直接丢弃)
+        self._not_before = {}     # route_key -> 最早可重试时间 (限流等失败后的退避)
+        self._in_flight = set()   # 已弹出、正在执行的线路
+        self._heap = []
+        self._seq = itertools.count()
+        self._max_id = 0
+        self._watermark = None
+
+    # ---------- 与数据库同步 ----------
+
+    def sync(self):
+        """首次全量加载监控中的任务，之后按 id/updated_at 水位线增量同步"""
+        if self._watermark is None:
+            rows = db.get_active_tasks()
+        else:
+            rows = db.get_tasks_changed_since(self._max_id, self._watermark - SYNC_OVERLAP)
+
+        for task in rows:
+            self._max_id = max(self._max_id, task.id)
+            if task.updated_at and (self._watermark is None or task.updated_at > self._watermark):
+                self._watermark = task.updated_at
+            if task.status == 1:
+                self._upsert(task)
+            else:
+                self._remove(task.id)
+
+        if self._watermark is None:
+            # 空表或旧表无 updated_at：从当前时刻开始增量
+            self._watermark = datetime.now()
+        self.rebalance()
+        return len(rows)
+
+    def rebalance(self):
+        """按当前的线路与订阅人数重新分配轮询间隔，间隔变化的线路重新入堆"""
+        changed = self.policy.rebalance({route_key: len(ids) for route_key, ids in self._routes.items()})
+        for route_key in changed:
+            self._reschedule(route_key)
+
+    def pop_due(self, limit=None, now=None):
+        """
+        弹出已到期的线路 (最多 limit 条，即执行器的空闲槽位数)，返回 {route_key: [到期任务]}
+        其余到期线路留在堆里：多 Worker 时不领走自己一时执行不了的线路，留给空闲的 Worker
+        执行前按 id 回库校验一次：已删除/停止的任务被剔除，其余用最新的行替换
+        """
+        now = now or time.time()
+        candidates = {}
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(candidates) < limit):
+            due, _, route_key = heapq.heappop(self._heap)
+            if self._route_due.get(route_key) != due:
+                continue  # 过期条目
+            del self._route_due[route_key]
+            candidates[route_key] = [t_id for t_id in self._routes.get(route_key, ()) if self._due(t_id, route_key) <= now]
+        if not candidates:
+            return {}
+
+        try:
+            if self.leases is not None:
+                # 先领租约再回库校验：别的 Worker 刚查完的线路，回库读到的检查时间已是最新，不会重复查询
+                claimed = self.leases.claim(candidates)
+                for route_key in [r for r in candidates if r not in claimed]:
+                    del candidates[route_key]
+                    self._not_before[route_key] = now + self.leases.busy_retry
+                    self._reschedule(route_key)
+            due_ids = {t_id for ids in candidates.values() for t_id in ids}
+            fresh = {task.id: task for task in db.get_active_tasks_by_ids(due_ids)} if due_ids else {}
+        except Exception:
+            # 数据库出错：已弹出的线路重新入堆，下轮再试 (租约会自然过期)
+            for route_key in candidates:
+                self._reschedule(route_key)
+            if self.leases is not None:
+                self.leases.abandon(candidates)
+            raise
+        # 先标记为执行中：回库刷新任务行时 _upsert 不会把这些线路重新入堆 (否则下一轮会重复弹出、重复执行)
+        self._in_flight.update(candidates)
+        for t_id in due_ids - fresh.keys():
+            self._remove(t_id)
+        for task in fresh.values():
+            self._upsert(task)
+
+        groups, idle = {}, []
+        for route_key in candidates:
+            tasks = [self._tasks[t_id] for t_id in candidates[route_key]
+                     if t_id in fresh and self._due(t_id, route_key) <= now]
+            if tasks:
+                groups[route_key] = tasks
+            else:
+                idle.append(route_key)
+                self._in_flight.discard(route_key)
+                self._reschedule(route_key)
+        if idle and self.leases is not None:
+            self.leases.release(idle)
+        return groups
+
+    def finish(self, route_key, checked_ids=(), retry_after=None):
+        """
+        线路执行结束：checked_ids 为本次已检查的任务 (本地推进 last_check，不必等下次同步)
+        retry_after 不为空表示本次未执行 (如限流)，该线路至少等待这么多秒再重试
+        """
+        self._in_flight.discard(route_key)
+        now = time.time()
+        for t_id in checked_ids:
+            if t_id in self._tasks:
+                self._task_last[t_id] = now
+        if retry_after:
+            self._not_before[route_key] = now + retry_after
+        else:
+            self._not_before.pop(route_key, None)
+        self._reschedule(route_key)
+
+    def seconds_until_next(self, max_wait):
+        """距离下一个到期线路的秒数，最多 max_wait (需定期醒来做增量同步以发现新任务)"""
+        while self._heap and self._route_due.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return max_wait
+        return max(0.0, min(max_wait, self._heap[0][0] - time.time()))
+
+    def due_backlog(self, now=None):
+        """已到期但还没有弹出 (等空闲槽位) 的线路上的任务数"""
+        now = now or time.time()
+        return sum(len(self._routes[route_key]) for route_key, due in self._route_due.items() if due <= now)
+
+    def __len__(self):
+        return len(self._tasks)
+
+    # ---------- 内部维护 ----------
+
+    def _due(self, t_id, route_key):
+        last_check = self._task_last[t_id]
+        return last_check + self.policy.interval(route_key) if last_check else 0.0
+
+    def _upsert(self, task):
+        t_id = task.id
+        old = self._tasks.get(t_id)
+        route_key = task.route_key
+        if old is not None and old.route_key != route_key:
+            self._remove(t_id)
+        self._tasks[t_id] = task
+        last_check = task.last_check_time.timestamp() if task.last_check_time else None
+        local = self._task_last.get(t_id)
+        # 库里的 DATETIME 只精确到秒，本地刚记录的更精确 (也更晚) 时保留本地值，避免提前最多 1 秒再次到期
+        self._task_last[t_id] = local if local and (last_check is None or local > last_check) else last_check
+        self._routes.setdefault(route_key, set()).add(t_id)
+        self._reschedule(route_key)
+
+    def _remove(self, t_id):
+        task = self._tasks.pop(t_id, None)
+        if task is None:
+            return
+        del self._task_last[t_id]
+        route_key = task.route_key
+        ids = self._routes.get(route_key)
+        if ids is not None:
+            ids.discard(t_id)
+            if not ids:
+                del self._routes[route_key]
+                self._not_before.pop(route_key, None)
+        self._reschedule(route_key)
+
+    def _reschedule(self, route_key):
+        if route_key in self._in_flight:
+            return  # 执行结束时由 finish() 重新入堆
+        ids = self._routes.get(route_key)
+        if not ids:
+            self._route_due.pop(route_key, None)
+            return
+        due = min(self._due(t_id, route_key) for t_id in ids)
+        due = max(due, self._not_before.get(route_key, 0.0))
+        if self._route_due.get(route_key) == due:
+            return
+        self._route_due[route_key] = due
+        heapq.heappush(self._heap, (due, next(self._seq), route_key))
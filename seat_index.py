@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from train_record import SEAT_NAMES
+
+
+class SeatIndex:
+    """
+    单次查询的席别索引 (线路组内所有订阅者共用)
+    席别 -> 有票车次集合 (用整数位集表示，第 i 位对应第 i 个车次)，
+    任务的匹配结果按筛选签名记忆：相同席别偏好的几百个订阅者只算一次，每次也只是几个位集的并集
+    """
+
+    def __init__(self, trains):
+        self.trains = trains
+        self._by_seat = dict.fromkeys(SEAT_NAMES, 0)
+        for i, train in enumerate(trains):
+            mask = train.mask
+            for bit, name in enumerate(SEAT_NAMES):
+                if mask >> bit & 1:
+                    self._by_seat[name] |= 1 << i
+        self._matches = {}
+
+    def available(self, target_seats):
+        """目标席别中任一有票的车次位集"""
+        bits = 0
+        for name in target_seats:
+            bits |= self._by_seat.get(name, 0)
+        return bits
+
+    def match(self, target_seats, train_filter=None):
+        """有票车次及其余票列表 [(train, ['二等:有', ...]), ...]，按查询结果原顺序"""
+        return [(self.trains[i], seats) for i, seats in self._match(target_seats, train_filter)]
+
+    def seat_lists(self, target_seats, train_filter=None):
+        """按车次下标排列的余票列表，无票或被筛掉的车次为 None"""
+        lists = [None] * len(self.trains)
+        for i, seats in self._match(target_seats, train_filter):
+            lists[i] = seats
+        return lists
+
+    def _match(self, target_seats, train_filter):
+        # 记忆键 = 筛选签名 (席别 + 车型/车次/时间段)
+        key = (tuple(target_seats), train_filter.key if train_filter else None)
+        result = self._matches.get(key)
+        if result is None:
+            result = []
+            bits = self.available(target_seats)
+            while bits:
+                low = bits & -bits
+                i = low.bit_length() - 1
+                train = self.trains[i]
+                if train_filter is None or train_filter.accepts_record(train):
+                    result.append((i, train.seat_list(target_seats)))
+                bits ^= low
+            self._matches[key] = result
+        return result
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+import requests
+from dotenv import load_dotenv
+from pacer import request_pacer
+import metrics
+from logutil import log
+
+load_dotenv()
+
+# 12306 站点地址；压测/仿真时可指向本地的模拟服务
+BASE_URL = os.getenv("TICKET_BASE_URL") or "https://kyfw.12306.cn/otn/"
+
+SESSION_CONFIG = {
+    "pool_size": int(os.getenv("SESSION_POOL_SIZE") or 3),  # 保温的 keep-alive 会话数
+    "url_ttl": float(os.getenv("QUERY_URL_TTL") or 1800)  # CLeftTicketUrl 缓存秒数
+}
+
+
+class StaleSessionError(Exception):
+    """查询结果表明查询地址或 cookie 已失效，需要重新初始化"""
+
+
+class QueryUrlChangedError(Exception):
+    """12306 在响应里告知了新的查询地址 (已写入缓存)，会话本身仍然有效，用新地址重试即可"""
+
+    def __init__(self, url):
+        super().__init__(f"查询地址已变更为 {url}")
+        self.url = url
+
+
+class SessionManager:
+    """
+    12306 会话管理器
+    - 复用 keep-alive 会话 (免去每次查询的 TLS 握手)
+    - 缓存从 leftTicket/init 解析出的查询地址 (CLeftTicketUrl)，带 TTL
+    - 只有查询结果显示地址/cookie 失效时才重新初始化 (次数记在 session_reinits_total)
+    """
+
+    def __init__(self, headers, pool_size, url_ttl):
+        self.headers = headers
+        self.pool_size = pool_size
+        self.url_ttl = url_ttl
+        self._idle = []  # 空闲会话，右端为最近归还
+        self._lock = threading.Lock()
+        self._query_url = None
+        self._url_expires = 0.0
+
+    @contextmanager
+    def session(self):
+        """借出 (session, query_url)；块内抛出 StaleSessionError 则作废该会话与地址缓存"""
+        session = self._take()
+        try:
+            yield session, self._ensure_url(session)
+        except StaleSessionError:
+            self.invalidate()
+            session.close()
+            raise
+        except requests.ConnectionError:
+            # 连接被对端断开之类，换个新会话即可，地址缓存仍然有效
+            session.close()
+            raise
+        except BaseException:
+            self._give_back(session)
+            raise
+        else:
+            self._give_back(session)
+
+    def check_response(self, res):
+        """
+        校验查询响应并返回 JSON；地址或 cookie 失效时抛出 StaleSessionError，地址变更时抛出 QueryUrlChangedError
+        429/5xx 等限流或服务端错误抛出 requests.HTTPError：会话本身没问题，重新初始化只会在限流时多发一次 init 请求
+        """
+        if res.is_redirect or res.history:
+            # 被重定向到登录页或 init 页：cookie 失效
+            target = res.headers.get("Location", "") if res.is_redirect else res.url
+            if re.search(r"login|leftTicket/init", target):
+                raise StaleSessionError(f"被重定向到 {target}")
+        if res.status_code != 200:
+            raise requests.HTTPError(f"HTTP {res.status_code}", response=res)
+        try:
+            res_json = res.json()
+        except ValueError:
+            # 地址过期或 cookie 失效时 12306 会返回一个 HTML 错误页
+            raise StaleSessionError("响应不是 JSON")
+        if res_json.get("c_url"):
+            # 12306 直接告知了新的查询地址：更新缓存 (不作废会话)，调用方用新地址重试
+            url = self._set_url(BASE_URL + res_json["c_url"])
+            metrics.QUERY_URL_CHANGES.inc()
+            raise QueryUrlChangedError(url)
+        return res_json
+
+    def invalidate(self):
+        """作废地址缓存，下一次借出时重新初始化"""
+        with self._lock:
+            self._query_url = None
+            self._url_expires = 0.0
+        metrics.SESSION_REINITS.inc()
+        log("♻️ 12306 会话失效，将重新初始化")
+
+    def _take(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.initialized = False
+        return session
+
+    def _give_back(self, session):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(session)
+                return
+        session.close()
+
+    def _ensure_url(self, session):
+        with self._lock:
+            url = self._query_url if time.monotonic() < self._url_expires else None
+        if url and session.initialized:
+            return url
+        # 新会话需要先访问 init 拿到 cookie；地址缓存过期时顺便刷新地址
+        return self._init_session(session) or url or BASE_URL + "leftTicket/query"
+
+    def _init_session(self, session):
+        try:
+            request_pacer.wait()
+            res = session.get(BASE_URL + "leftTicket/init", timeout=5)
+            session.initialized = True
+            match = re.search(r"CLeftTicketUrl\s*=\s*'([^']+)'", res.text)
+            if match:
+                return self._set_url(BASE_URL + match.group(1))
+        except Exception as e:
+            log(f"⚠️ 12306 会话初始化失败: {e}")
+        return None
+
+    def _set_url(self, url):
+        with self._lock:
+            self._query_url = url
+            self._url_expires = time.monotonic() + self.url_ttl
+        return url
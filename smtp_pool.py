@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import os
+import smtplib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from email.header import Header
+from dotenv import load_dotenv
+import metrics
+from logutil import log
+
+load_dotenv()
+
+SMTP_CONFIG = {
+    "server": os.getenv("SMTP_SERVER") or "smtp.qq.com",
+    "port": int(os.getenv("SMTP_PORT") or 465),
+    "user": os.getenv("SMTP_USER") or "",
+    "password": os.getenv("SMTP_PASSWORD") or "",
+    "use_ssl": (os.getenv("SMTP_USE_SSL") or "1") != "0",  # 0 = 明文 SMTP (本地调试用)
+    "pool_size": int(os.getenv("SMTP_POOL_SIZE") or 2),  # 保持登录状态的连接数
+    "keepalive": float(os.getenv("SMTP_KEEPALIVE_SECONDS") or 60),  # 空闲超过该秒数，复用前先 NOOP 探活
+    "max_idle": float(os.getenv("SMTP_MAX_IDLE_SECONDS") or 240)  # 空闲超过该秒数直接关闭 (服务端多半已断开)
+}
+
+
+def build_message(sender, receiver, title, content):
+    msg = MIMEText(content, 'html', 'utf-8')
+    msg['From'] = Header("12306云监控", 'utf-8')
+    msg['From'].append(f"<{sender}>", 'ascii')
+    msg['To'] = Header("用户", 'utf-8')
+    msg['Subject'] = Header(title, 'utf-8')
+    return msg.as_string()
+
+
+class SmtpPool:
+    """
+    SMTP 连接池：保持少量已登录的连接，复用前 NOOP 探活，发送失败自动重连重试一次
+    send_many 把一整组邮件分摊到池中的连接上并发发送，省去每封邮件的 TLS 握手与登录
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._idle = []  # (smtp, 归还时间)
+        self._lock = threading.Lock()
+
+    def send(self, receiver, title, content):
+        return self.send_many([(receiver, title, content)])[0]
+
+    def send_many(self, messages):
+        """messages 为 [(收件人, 标题, HTML 正文)]，返回与之对应的发送结果列表 [bool]"""
+        messages = list(messages)
+        if not messages:
+            return []
+        workers = min(self.config["pool_size"], len(messages))
+        if workers <= 1:
+            return self._send_batch(messages)
+        # 按连接数切片，每个线程借一个连接发自己那一片
+        chunks = [messages[i::workers] for i in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            chunk_results = list(executor.map(self._send_batch, chunks))
+        results = [None] * len(messages)
+        for i, chunk_result in enumerate(chunk_results):
+            results[i::workers] = chunk_result
+        return results
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for smtp, _ in idle:
+            self._quit(smtp)
+
+    def _send_batch(self, messages):
+        results = []
+        smtp = None
+        for receiver, title, content in messages:
+            body = build_message(self.config["user"], receiver, title, content)
+            ok = False
+            start = time.perf_counter()
+            for attempt in range(2):
+                try:
+                    if smtp is None:
+                        smtp = self._take()
+                    smtp.sendmail(self.config["user"], [receiver], body)
+                    ok = True
+                    break
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    # 收件人/内容被拒，重连也没用
+                    log(f"邮件发送失败 ({receiver}): {e}")
+                    break
+                except Exception as e:
+                    # 连接断开、超时等：丢弃该连接，换新连接重试一次
+                    if smtp is not None:
+                        self._quit(smtp)
+                        smtp = None
+                    if attempt == 1:
+                        log(f"邮件发送失败 ({receiver}): {e}")
+            metrics.EMAIL_SEND_SECONDS.observe(time.perf_counter() - start, result="ok" if ok else "failed")
+            results.append(ok)
+        if smtp is not None:
+            self._give_back(smtp)
+        return results
+
+    def _take(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                smtp, last_used = self._idle.pop()
+            idle = time.monotonic() - last_used
+            if idle > self.config["max_idle"]:
+                self._quit(smtp)
+                continue
+            if idle > self.config["keepalive"]:
+                try:
+                    if smtp.noop()[0] != 250:
+                        raise smtplib.SMTPServerDisconnected("NOOP 失败")
+                except Exception:
+                    self._quit(smtp)
+                    continue
+            return smtp
+        return self._connect()
+
+    def _give_back(self, smtp):
+        with self._lock:
+            if len(self._idle) < self.config["pool_size"]:
+                self._idle.append((smtp, time.monotonic()))
+                return
+        self._quit(smtp)
+
+    def _connect(self):
+        cfg = self.config
+        if cfg["use_ssl"]:
+            smtp = smtplib.SMTP_SSL(cfg["server"], cfg["port"], timeout=10)
+        else:
+            smtp = smtplib.SMTP(cfg["server"], cfg["port"], timeout=10)
+        if cfg["user"]:
+            smtp.login(cfg["user"], cfg["password"])
+        return smtp
+
+    @staticmethod
+    def _quit(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+
+# 进程内共享的 SMTP 连接池
+smtp_pool = SmtpPool(SMTP_CONFIG)
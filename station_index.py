@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import threading
+import time
+import requests
+from dotenv import load_dotenv
+from session_pool import BASE_URL
+from logutil import log
+
+load_dotenv()
+
+STATION_JS_URL = BASE_URL + "resources/js/framework/station_name.js"
+STATION_FORMAT = 1  # 本地文件格式版本，结构变化时加一，旧文件会被自动重建
+
+STATION_CONFIG = {
+    "path": os.getenv("STATION_INDEX_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "station_index.json"),
+    "max_age": float(os.getenv("STATION_INDEX_MAX_AGE_DAYS") or 7) * 86400,  # 超过该时长在后台重新下载
+    "timeout": 10
+}
+
+
+def parse_station_js(text):
+    """station_name.js -> [(中文名, 电报码, 全拼, 简拼)]，保持官方顺序"""
+    # 结构: @bjb|北京北|VAP|beijingbei|bjb|0|...
+    stations = []
+    for part in text.split('@')[1:]:
+        infos = part.split('|')
+        if len(infos) > 4 and infos[1] and infos[2]:
+            stations.append((infos[1], infos[2], infos[3].lower(), infos[4].lower()))
+    return stations
+
+
+class _Snapshot:
+    """一份不可变的索引，刷新时整体替换，读取无需加锁"""
+
+    def __init__(self, stations, fetched_at):
+        self.stations = stations
+        self.fetched_at = fetched_at
+        self.code_by_name = {}
+        self.name_by_code = {}
+        self.pinyin_by_name = {}
+        for name, code, pinyin, abbr in stations:
+            self.code_by_name.setdefault(name, code)
+            self.name_by_code.setdefault(code, name)
+            self.pinyin_by_name.setdefault(name, (pinyin, abbr))
+        self.names = list(self.code_by_name)
+
+
+class StationIndex:
+    """
+    车站索引：station_name.js 下载一次后落盘，进程启动直接读本地文件，无需联网
+    中文名 <-> 电报码双向 O(1) 查找，下拉框按中文/全拼/简拼过滤 (见 label)
+    本地文件过期后在后台线程刷新，刷新失败继续使用旧数据
+    """
+
+    def __init__(self, path, max_age, timeout=10):
+        self.path = path
+        self.max_age = max_age
+        self.timeout = timeout
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._retry_at = 0.0  # 后台刷新失败后，该时刻之前不再重试
+
+    # ---------- 查询 ----------
+
+    def names(self):
+        """全部车站中文名 (官方顺序)，用于下拉框"""
+        return self._get().names
+
+    def code_of(self, name):
+        return self._get().code_by_name.get(name)
+
+    def name_of(self, code):
+        """电报码 -> 中文名；找不到时原样返回，界面和邮件里至少还能看到代码"""
+        if not code:
+            return code
+        return self._get().name_by_code.get(code, code)
+
+    def label(self, name):
+        """下拉框显示文本：中文名附带全拼与简拼，下拉框的输入过滤因此也能按拼音匹配"""
+        pinyin = self._get().pinyin_by_name.get(name)
+        return f"{name} ({pinyin[0]} / {pinyin[1]})" if pinyin else name
+
+    def __len__(self):
+        return len(self._get().names)
+
+    def __contains__(self, name):
+        return name in self._get().code_by_name
+
+    # ---------- 加载与刷新 ----------
+
+    def refresh(self):
+        """下载最新的 station_name.js 并原子替换本地文件，返回是否成功"""
+        try:
+            res = requests.get(STATION_JS_URL, headers={"User-Agent": "Mozilla/5.0"}, timeout=self.timeout)
+            res.encoding = 'utf-8'
+            stations = parse_station_js(res.text)
+        except Exception as e:
+            log(f"⚠️ 车站数据下载失败: {e}")
+            return False
+        if not stations:
+            log("⚠️ 车站数据为空，保留旧索引")
+            return False
+
+        fetched_at = time.time()
+        self._save(stations, fetched_at)
+        self._snapshot = _Snapshot(stations, fetched_at)
+        log(f"🚉 车站索引已更新: {len(stations)} 个车站")
+        return True
+
+    def _get(self):
+        snap = self._snapshot
+        if snap is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._load() or _Snapshot([], 0.0)
+                    if not self._snapshot.stations and not self.refresh():
+                        # 本地没有可用文件 (首次部署)：同步下载一次，失败后按退避时间在后台重试
+                        self._backoff()
+            snap = self._snapshot
+        now = time.time()
+        # 空索引的 fetched_at 为 0，同样视为过期：首次下载失败后也会继续重试，而不是一直用空数据
+        if now - snap.fetched_at > self.max_age and now >= self._retry_at:
+            self._refresh_in_background()
+        return snap
+
+    def _backoff(self):
+        """刷新失败：有旧数据时一小时后再试，还没有任何数据时五分钟后再试，避免每次查询都发起下载"""
+        snap = self._snapshot
+        self._retry_at = time.time() + (3600 if snap and snap.stations else 300)
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                if not self.refresh():
+                    self._backoff()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("format") != STATION_FORMAT:
+            return None
+        return _Snapshot([tuple(s.split('|')) for s in data["stations"]], data.get("fetched_at", 0.0))
+
+    def _save(self, stations, fetched_at):
+        data = {"format": STATION_FORMAT, "fetched_at": fetched_at,
+                "stations": ["|".join(s) for s in stations]}
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log(f"⚠️ 车站索引写入失败: {e}")
+
+
+# 进程内共享的车站索引 (Web 前台与后台 Worker 共用同一个本地文件)
+station_index = StationIndex(STATION_CONFIG["path"], STATION_CONFIG["max_age"], STATION_CONFIG["timeout"])
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+单元测试：python -m pytest tests (不需要 MySQL、12306 与 SMTP，数据库用临时目录里的 SQLite)
+"""
+import os
+import sys
+import tempfile
+
+# 测试用嵌入式 SQLite (无需 MySQL 服务)，须在导入 database 之前设置；.env 不会覆盖已有的环境变量
+_TMP = tempfile.mkdtemp(prefix="ticket_monitor_test_")
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_TMP, "test.db")
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+os.environ["METRICS_PORT"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from change_detector import (ChangeDetector, encode_entries, seat_entries, decide,
+                             SKIP, NOTIFY, CLEAR, NOTIFY_COOLDOWN)
+
+
+def entries(*items):
+    """[(车次, '二等:有'), ...] -> 任务相关余票条目"""
+    result = []
+    for codes, seat in items:
+        result.extend(seat_entries(codes, [seat]))
+    return result
+
+
+def test_encode_entries_is_order_independent_and_keeps_highest_bucket():
+    a = encode_entries(entries(("G1", "二等:3"), ("G2", "硬卧:有")))
+    b = encode_entries(entries(("G2", "硬卧:有"), ("G1", "二等:3")))
+    assert a == b
+    assert sorted(int(item.split(":")[1]) for item in a.split(",")) == [1, 3]
+    # 同一车次席别出现多次 (如中转两程) 取最高档位
+    assert encode_entries(entries(("G1", "二等:3"), ("G1", "二等:有"))) == encode_entries(entries(("G1", "二等:有")))
+    assert encode_entries([]) == ""
+
+
+def test_decide_notifies_on_new_train_or_higher_bucket_without_cooldown():
+    just_now = datetime.now()
+    stored = encode_entries(entries(("G1", "二等:3")))
+    assert decide(encode_entries(entries(("G1", "二等:3"), ("G2", "二等:1"))), stored, just_now) == NOTIFY
+    assert decide(encode_entries(entries(("G1", "二等:有"))), stored, just_now) == NOTIFY
+
+
+def test_decide_waits_for_cooldown_when_nothing_grew():
+    stored = encode_entries(entries(("G1", "二等:有"), ("G2", "二等:有")))
+    same = stored
+    fewer = encode_entries(entries(("G1", "二等:3")))
+    just_now = datetime.now()
+    assert decide(same, stored, just_now) == SKIP
+    assert decide(fewer, stored, just_now) == SKIP
+    long_ago = datetime.now() - timedelta(seconds=NOTIFY_COOLDOWN + 1)
+    assert decide(fewer, stored, long_ago) == NOTIFY
+
+
+def test_decide_clears_when_availability_is_gone():
+    stored = encode_entries(entries(("G1", "二等:有")))
+    assert decide("", stored, datetime.now()) == CLEAR
+    assert decide("", None, None) == SKIP
+
+
+def test_decide_treats_legacy_digest_as_new():
+    assert decide(encode_entries(entries(("G1", "二等:有"))), "0123456789abcdef", datetime.now()) == NOTIFY
+
+
+def test_forget_drops_task_state_of_the_route():
+    detector = ChangeDetector()
+    route = ("A", "B", "2026-01-01", None)
+    detector.observe(route, "s1")
+    detector.mark_evaluated(route, [1, 2], "s1")
+    assert not detector.needs_evaluation(route, 1, "s1", None, None)
+    assert detector.needs_evaluation(route, 1, "s2", None, None)
+    detector.forget([route])
+    assert detector.needs_evaluation(route, 1, "s1", None, None)
+    assert detector.volatility(route) is None
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import rate_limiter
+from rate_limiter import MemoryTokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_burst_then_rejects(clock):
+    bucket = MemoryTokenBucket(rate_per_minute=6, burst=3)
+    assert [bucket.acquire(1) for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_at_rate_and_caps_at_burst(clock):
+    bucket = MemoryTokenBucket(rate_per_minute=6, burst=2)  # 每 10 秒补充一个
+    assert bucket.acquire(2)
+    clock.now += 9
+    assert not bucket.acquire(1)
+    clock.now += 1
+    assert bucket.acquire(1)
+    clock.now += 3600
+    assert bucket.acquire(2)
+    assert not bucket.acquire(1)
+
+
+def test_bucket_reports_wait_time(clock):
+    bucket = MemoryTokenBucket(rate_per_minute=6, burst=1)
+    assert bucket._try_take(1) == 0.0
+    assert bucket._try_take(1) == pytest.approx(10.0)
+
+
+def test_cost_above_capacity_is_rejected(clock):
+    with pytest.raises(ValueError):
+        MemoryTokenBucket(rate_per_minute=6, burst=2).acquire(3)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import database as db
+from migrations import init_db
+from route_leases import RouteLeases
+
+ROUTE_A = ("A", "B", "2099-01-01", None)
+ROUTE_B = ("A", "D", "2099-01-01", "B")
+
+
+@pytest.fixture(scope="module", autouse=True)
+def schema():
+    init_db()
+
+
+@pytest.fixture(autouse=True)
+def empty_leases():
+    with db.db_cursor() as c:
+        c.execute("DELETE FROM route_leases")
+        c.execute("DELETE FROM worker_heartbeats")
+
+
+def make_leases(owner, host="host-1", ttl=60):
+    return RouteLeases(owner, host, ttl, busy_retry=15, prune_interval=3600, idle_seconds=86400)
+
+
+def test_claim_is_exclusive_until_released():
+    a, b = make_leases("a"), make_leases("b")
+    assert a.claim([ROUTE_A, ROUTE_B]) == {ROUTE_A, ROUTE_B}
+    assert b.claim([ROUTE_A, ROUTE_B]) == set()
+    a.release([ROUTE_A])
+    assert b.claim([ROUTE_A, ROUTE_B]) == {ROUTE_A}
+    assert set(a.held()) == {ROUTE_B}
+
+
+def test_owner_can_reclaim_its_own_lease():
+    a = make_leases("a")
+    assert a.claim([ROUTE_A]) == {ROUTE_A}
+    assert a.claim([ROUTE_A]) == {ROUTE_A}
+
+
+def test_expired_lease_can_be_taken_over():
+    crashed = make_leases("crashed", ttl=-1)  # 领到即过期，相当于 Worker 崩溃后 ttl 已过
+    assert crashed.claim([ROUTE_A]) == {ROUTE_A}
+    assert make_leases("b").claim([ROUTE_A]) == {ROUTE_A}
+
+
+def test_renew_extends_only_own_leases():
+    a = make_leases("a")
+    a.claim([ROUTE_A])
+    key = db.route_lease_key(ROUTE_A)
+    assert db.renew_route_leases([key], "a", 60) == 1
+    assert db.renew_route_leases([key], "b", 60) == 0
+
+
+def test_released_lease_rows_are_pruned_once_idle():
+    a = make_leases("a")
+    a.claim([ROUTE_A, ROUTE_B])
+    a.release([ROUTE_A])
+    assert db.prune_route_leases(idle_seconds=-1, today="2026-01-01") == 1  # ROUTE_B 仍被持有，不删
+    # 被清理的行下次领取时重新建行
+    assert make_leases("b").claim([ROUTE_A]) == {ROUTE_A}
+
+
+def test_heartbeat_counts_distinct_hosts():
+    assert make_leases("a1", host="h1").heartbeat() == 1
+    assert make_leases("a2", host="h1").heartbeat() == 1
+    assert make_leases("b1", host="h2").heartbeat() == 2
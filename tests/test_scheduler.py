@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+import pytest
+
+import scheduler as scheduler_module
+from database import WorkerTask
+from scheduler import TaskScheduler
+
+ROUTE_A = ("A", "B", "2026-01-01", None)
+ROUTE_B = ("A", "C", "2026-01-01", None)
+ROUTE_C = ("A", "D", "2026-01-01", "B")
+
+
+class FixedPolicy:
+    """每条线路固定 60 秒间隔"""
+
+    def rebalance(self, counts):
+        return []
+
+    def interval(self, route_key):
+        return 60.0
+
+
+def make_task(task_id, route_key, status=1):
+    f_st, t_st, date, m_st = route_key
+    return WorkerTask(task_id, f_st, t_st, date, "", "二等", "a@example.com", status, None, None, m_st,
+                      datetime.now(), None, None, None, None)
+
+
+class FakeTable:
+    """代替 database 的任务查询：tasks 为当前监控中的任务"""
+
+    def __init__(self, monkeypatch, tasks):
+        self.tasks = {task.id: task for task in tasks}
+        monkeypatch.setattr(scheduler_module.db, "get_active_tasks", lambda: list(self.tasks.values()))
+        monkeypatch.setattr(scheduler_module.db, "get_tasks_changed_since", lambda last_id, since: [])
+        monkeypatch.setattr(scheduler_module.db, "get_active_tasks_by_ids",
+                            lambda ids: [self.tasks[t_id] for t_id in ids if t_id in self.tasks])
+
+
+@pytest.fixture
+def table(monkeypatch):
+    return FakeTable(monkeypatch, [make_task(1, ROUTE_A), make_task(2, ROUTE_A),
+                                   make_task(3, ROUTE_B), make_task(4, ROUTE_C)])
+
+
+def test_never_checked_tasks_are_due_immediately_and_grouped_by_route(table):
+    s = TaskScheduler(FixedPolicy())
+    s.sync()
+    groups = s.pop_due(now=1000.0)
+    assert {route: sorted(t.id for t in tasks) for route, tasks in groups.items()} == {
+        ROUTE_A: [1, 2], ROUTE_B: [3], ROUTE_C: [4]}
+
+
+def test_in_flight_routes_are_not_popped_again(table):
+    s = TaskScheduler(FixedPolicy())
+    s.sync()
+    assert s.pop_due(now=1000.0)
+    s.sync()
+    assert s.pop_due(now=2000.0) == {}
+
+
+def test_limit_leaves_remaining_due_routes_in_heap(table):
+    s = TaskScheduler(FixedPolicy())
+    s.sync()
+    first = s.pop_due(limit=2, now=1000.0)
+    assert len(first) == 2
+    assert s.due_backlog(now=1000.0) == 1
+    rest = s.pop_due(limit=2, now=1000.0)
+    assert set(rest) == {ROUTE_A, ROUTE_B, ROUTE_C} - set(first)
+    assert s.pop_due(now=1000.0) == {}
+
+
+def test_finish_reschedules_by_interval(table, monkeypatch):
+    s = TaskScheduler(FixedPolicy())
+    s.sync()
+    groups = s.pop_due(now=1000.0)
+    monkeypatch.setattr(scheduler_module.time, "time", lambda: 1000.0)
+    for route, tasks in groups.items():
+        s.finish(route, [t.id for t in tasks])
+    assert s.pop_due(now=1059.0) == {}
+    assert set(s.pop_due(now=1060.0)) == {ROUTE_A, ROUTE_B, ROUTE_C}
+
+
+def test_failed_route_waits_retry_after(table, monkeypatch):
+    s = TaskScheduler(FixedPolicy())
+    s.sync()
+    s.pop_due(now=1000.0)
+    monkeypatch.setattr(scheduler_module.time, "time", lambda: 1000.0)
+    s.finish(ROUTE_A, retry_after=15)
+    assert s.pop_due(now=1014.0) == {}
+    assert set(s.pop_due(now=1015.0)) == {ROUTE_A}
+
+
+def test_tasks_stopped_before_execution_are_dropped(table):
+    s = TaskScheduler(FixedPolicy())
+    s.sync()
+    del table.tasks[3]
+    groups = s.pop_due(now=1000.0)
+    assert ROUTE_B not in groups
+    assert len(s) == 3
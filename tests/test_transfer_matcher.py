@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from train_record import TrainRecord, SEAT_NAMES
+from transfer_matcher import TransferMatcher, to_minutes
+
+
+def make_train(code, start, end, seats=("二等",)):
+    counts = tuple("有" if name in seats else "无" for name in SEAT_NAMES)
+    return TrainRecord(code, start, end, counts)
+
+
+def brute_force(trains_1, trains_2, target_seats, limit):
+    """原来的两重循环：等待 = 第二程出发 - 第一程到达 (早于到达视为次日)，>= 40 分钟，按等待时间排序"""
+    plans = []
+    for order_1, t1 in enumerate(trains_1):
+        seats_1 = t1.seat_list(target_seats)
+        arrive = to_minutes(t1.end)
+        if not seats_1 or arrive is None:
+            continue
+        for order_2, t2 in enumerate(trains_2):
+            seats_2 = t2.seat_list(target_seats)
+            depart = to_minutes(t2.start)
+            if not seats_2 or depart is None:
+                continue
+            wait = depart - arrive if depart >= arrive else depart + 24 * 60 - arrive
+            if wait >= 40:
+                key = (wait, to_minutes(t1.start) or 0, order_1, order_2)
+                plans.append((key, (t1.code, t2.code, wait, seats_1, seats_2)))
+    plans.sort(key=lambda p: p[0])
+    return [plan for _, plan in plans[:limit]]
+
+
+def matched(trains_1, trains_2, target_seats, limit=5):
+    return [(t1.code, t2.code, wait, s1, s2)
+            for t1, t2, wait, s1, s2 in TransferMatcher(trains_1, trains_2).match(target_seats, limit)]
+
+
+def test_cross_midnight_connection():
+    trains_1 = [make_train("A1", "20:00", "23:50")]
+    trains_2 = [make_train("B1", "00:10", "03:00"), make_train("B2", "00:40", "04:00"), make_train("B3", "23:55", "06:00")]
+    # 23:55 只等 5 分钟不够换乘；次日 00:10 等 20 分钟不够，00:40 等 50 分钟
+    assert [(c1, c2, w) for c1, c2, w, _, _ in matched(trains_1, trains_2, ["二等"])] == [("A1", "B2", 50)]
+
+
+def test_same_day_before_next_day_and_exact_minimum():
+    trains_1 = [make_train("A1", "06:00", "10:00")]
+    trains_2 = [make_train("B1", "09:59", "12:00"), make_train("B2", "10:40", "12:00"), make_train("B3", "10:39", "12:00")]
+    # 09:59 视为次日 (等 1439 分钟)，10:39 差一分钟不够
+    assert [(c2, w) for _, c2, w, _, _ in matched(trains_1, trains_2, ["二等"])] == [("B2", 40), ("B1", 1439)]
+
+
+def test_trains_without_target_seats_are_skipped():
+    trains_1 = [make_train("A1", "06:00", "10:00", seats=("硬卧",)), make_train("A2", "07:00", "11:00")]
+    trains_2 = [make_train("B1", "12:00", "14:00", seats=()), make_train("B2", "13:00", "15:00")]
+    assert [(c1, c2) for c1, c2, _, _, _ in matched(trains_1, trains_2, ["二等"])] == [("A2", "B2")]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_brute_force_on_random_routes(seed):
+    rng = random.Random(seed)
+
+    def random_trains(prefix, count):
+        trains = []
+        for i in range(count):
+            start, end = rng.randrange(24 * 60), rng.randrange(24 * 60)
+            counts = tuple(rng.choice(("有", "无", "", "3", "12")) for _ in SEAT_NAMES)
+            trains.append(TrainRecord(f"{prefix}{i}", f"{start // 60:02d}:{start % 60:02d}",
+                                      f"{end // 60:02d}:{end % 60:02d}", counts))
+        return trains
+
+    trains_1, trains_2 = random_trains("A", rng.randint(0, 40)), random_trains("B", rng.randint(0, 40))
+    for _ in range(10):
+        target_seats = rng.sample(SEAT_NAMES, rng.randint(1, 3))
+        limit = rng.randint(1, 10)
+        assert matched(trains_1, trains_2, target_seats, limit) == brute_force(trains_1, trains_2, target_seats, limit)
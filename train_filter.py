@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import re
+from transfer_matcher import to_minutes
+from train_record import seat_mask
+
+TRAIN_TYPE_OPTIONS = ("高铁(G/C)", "动车(D)", "普速(Z/T/K)")
+
+# 普速车除了 Z/T/K 还有纯数字车次 (普快/临客)
+_DIGITS = tuple("0123456789")
+
+
+def parse_train_types(text):
+    """'高铁(G/C),动车(D)' -> ('G', 'C', 'D')；为空或全选表示不限车型"""
+    items = [item.strip() for item in (text or "").split(',') if item.strip()]
+    if not items or set(TRAIN_TYPE_OPTIONS) <= set(items):
+        return None
+    prefixes = []
+    for item in items:
+        if '(' in item:
+            prefixes.extend(re.findall(r"[A-Z]", item[item.index('('):]))
+        if item.startswith("普速"):
+            prefixes.extend(_DIGITS)
+    return tuple(dict.fromkeys(prefixes)) or None
+
+
+def parse_window(text):
+    """'06:00-12:00' -> (360, 720)；为空或格式不对表示不限时间"""
+    if not text or '-' not in text:
+        return None
+    lo, hi = (to_minutes(x.strip()) for x in text.split('-', 1))
+    if lo is None or hi is None:
+        return None
+    return lo, hi
+
+
+def _in_window(window, hhmm):
+    if window is None:
+        return True
+    minutes = to_minutes(hhmm)
+    if minutes is None:
+        return False
+    lo, hi = window
+    if lo <= hi:
+        return lo <= minutes <= hi
+    return minutes >= lo or minutes <= hi  # 跨午夜的时间段，如 22:00-06:00
+
+
+class TrainFilter:
+    """单个订阅者对某一程的筛选条件：车型前缀、指定车次、发车/到达时间段、目标席别"""
+    __slots__ = ("prefixes", "codes", "depart", "arrive", "seats", "key")
+
+    def __init__(self, prefixes=None, codes=None, depart=None, arrive=None, seats=None):
+        self.prefixes = prefixes
+        self.codes = codes
+        self.depart = depart
+        self.arrive = arrive
+        self.seats = seat_mask(seats) if seats else None
+        self.key = (prefixes, codes, depart, arrive, self.seats)
+
+    @classmethod
+    def from_task(cls, task, leg=None):
+        """
+        由任务行构造筛选条件
+        leg=None 直达；leg=1 中转第一程 (只限发车时间)；leg=2 中转第二程 (只限到达时间)
+        """
+        codes = task.train_codes if leg is None else None
+        depart = task.depart_window if leg != 2 else None
+        arrive = task.arrive_window if leg != 1 else None
+        return cls(
+            prefixes=parse_train_types(task.train_types),
+            codes=frozenset(c.strip().upper() for c in codes.split(',') if c.strip()) if codes else None,
+            depart=parse_window(depart),
+            arrive=parse_window(arrive),
+            seats=task.seat_types.split(',')
+        )
+
+    def accepts_code(self, code):
+        if self.codes is not None and code not in self.codes:
+            return False
+        return self.prefixes is None or code.startswith(self.prefixes)
+
+    def accepts(self, code, start, end, mask):
+        return (self.accepts_code(code)
+                and (self.seats is None or mask & self.seats)
+                and _in_window(self.depart, start)
+                and _in_window(self.arrive, end))
+
+    def accepts_record(self, train):
+        return self.accepts(train.code, train.start, train.end, train.mask)
+
+
+class RouteFilter:
+    """
+    线路组内所有订阅者筛选条件的并集 (按条件去重)，解析时下推使用：
+    任何订阅者都不可能要的行在构建 TrainRecord 之前就被丢弃
+    """
+
+    def __init__(self, filters):
+        self.filters = tuple({f.key: f for f in filters}.values())
+
+    def accepts_code(self, code):
+        return any(f.accepts_code(code) for f in self.filters)
+
+    def accepts(self, code, start, end, mask):
+        return any(f.accepts(code, start, end, mask) for f in self.filters)
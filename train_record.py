@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# 12306 查询结果 (| 分隔) 中各席别所在的列
+SEAT_COLUMNS = (
+    ("商务", 32), ("一等", 31), ("二等", 30),
+    ("软卧", 23), ("硬卧", 28), ("硬座", 29), ("无座", 26)
+)
+SEAT_NAMES = tuple(name for name, _ in SEAT_COLUMNS)
+SEAT_BITS = {name: 1 << i for i, name in enumerate(SEAT_NAMES)}
+_LAST_COLUMN = max(col for _, col in SEAT_COLUMNS)
+
+
+def _count_mask(counts):
+    mask = 0
+    for i, count in enumerate(counts):
+        if count and count != '无':
+            mask |= 1 << i
+    return mask
+
+
+def seat_mask(seat_names):
+    """席别名列表 -> 位掩码 (未知席别忽略)"""
+    mask = 0
+    for name in seat_names:
+        mask |= SEAT_BITS.get(name, 0)
+    return mask
+
+
+class TrainRecord:
+    """
+    紧凑的车次记录：只保留车次号、发到时间和 7 个席别的余票
+    余票按 SEAT_NAMES 顺序存成元组，有票的席别另存为位掩码，匹配时只做位运算
+    """
+    __slots__ = ("code", "start", "end", "counts", "mask")
+
+    def __init__(self, code, start, end, counts, mask=None):
+        self.code = code
+        self.start = start
+        self.end = end
+        self.counts = counts
+        self.mask = _count_mask(counts) if mask is None else mask
+
+    @classmethod
+    def parse(cls, item, row_filter=None):
+        """
+        解析一条查询结果；只切分到最后一个席别列，其后的几十列不拆，格式不对返回 None
+        row_filter 为下推的筛选条件：先只切出车次号筛一遍，再按发到时间/席别筛，不满足的行不建对象
+        """
+        if row_filter is not None:
+            head = item.split('|', 4)
+            if len(head) < 5 or not row_filter.accepts_code(head[3]):
+                return None
+        parts = item.split('|', _LAST_COLUMN + 1)
+        if len(parts) <= _LAST_COLUMN:
+            return None
+        counts = tuple(parts[col] for _, col in SEAT_COLUMNS)
+        mask = _count_mask(counts)
+        if row_filter is not None and not row_filter.accepts(parts[3], parts[8], parts[9], mask):
+            return None
+        return cls(parts[3], parts[8], parts[9], counts, mask)
+
+    @property
+    def seats(self):
+        """{席别: 余票} (仅用于展示/调试，热路径请用 mask 与 seat_list)"""
+        return dict(zip(SEAT_NAMES, self.counts))
+
+    def seat_list(self, target_seats):
+        """目标席别中有票的 ['二等:有', '硬卧:3', ...]，顺序同 target_seats"""
+        mask = self.mask
+        result = []
+        for name in target_seats:
+            bit = SEAT_BITS.get(name, 0)
+            if mask & bit:
+                result.append(f"{name}:{self.counts[bit.bit_length() - 1]}")
+        return result
+
+    def __repr__(self):
+        return f"TrainRecord({self.code} {self.start}-{self.end} mask={self.mask:07b})"
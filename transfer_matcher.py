@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+import heapq
+from bisect import bisect_left
+from seat_index import SeatIndex
+
+MIN_TRANSFER_MINUTES = 40  # 最短换乘时间
+DAY_MINUTES = 24 * 60
+
+
+def to_minutes(hhmm):
+    """'HH:MM' -> 当天的分钟数，无法解析返回 None"""
+    try:
+        h, m = hhmm.split(':')
+        return int(h) * 60 + int(m)
+    except (AttributeError, ValueError):
+        return None
+
+
+class TransferMatcher:
+    """
+    中转方案匹配 (每次查询构建一次，组内所有任务共用)
+    - 时间只解析一次为整数分钟
+    - 第二程按出发时间排序；每个第一程车次的候选第二程从 到达+40 起顺延、过零点接次日，本身就按等待时间有序
+    - 各第一程的候选序列做惰性多路归并，取够 limit 个方案即停，不再展开两程的全部组合
+    - 两程各建一个席别索引，余票按车次只算一次；同一席别偏好的方案在任务间复用
+    """
+
+    def __init__(self, trains_1, trains_2):
+        self._leg1 = []
+        for order, t1 in enumerate(trains_1):
+            arrive = to_minutes(t1.end)
+            if arrive is not None:
+                self._leg1.append((t1, to_minutes(t1.start) or 0, arrive, order))
+
+        leg2 = []
+        for order, t2 in enumerate(trains_2):
+            depart = to_minutes(t2.start)
+            if depart is not None:
+                leg2.append((depart, order, t2))
+        leg2.sort(key=lambda x: (x[0], x[1]))
+        self._departs = [x[0] for x in leg2]
+        self._leg2 = [x[2] for x in leg2]
+        self._leg2_orders = [x[1] for x in leg2]
+        self._index_1 = SeatIndex(trains_1)
+        self._index_2 = SeatIndex(trains_2)
+        self._seat_cache = {}
+        self._plan_cache = {}
+
+    def match(self, target_seats, limit=5, filter_1=None, filter_2=None):
+        """
+        返回按换乘等待时间排序的前 limit 个方案
+        每个方案为 (t1, t2, 等待分钟, 第一程余票列表, 第二程余票列表)
+        filter_1/filter_2 为该任务对两程的筛选条件 (车型、时间段)
+        """
+        filters = (filter_1, filter_2)
+        key = (tuple(target_seats), limit, tuple(f.key if f else None for f in filters))
+        cached = self._plan_cache.get(key)
+        if cached is None:
+            seats_1_of, leg2 = self._seats_for(target_seats, filters)
+            cached = self._plan_cache[key] = self._best_plans(seats_1_of, leg2, limit)
+        return cached
+
+    def _best_plans(self, seats_1_of, leg2, limit):
+        """
+        多路归并：堆里每个第一程车次只放它等待最短的一个候选，弹出后推进该车次的游标，取够 limit 个即停
+        排序键: 等待时间，其次第一程出发时间，再按原始顺序保持稳定
+        """
+        departs, _, seats_2 = leg2
+        heap = []
+        for t1, start_1, arrive, order in self._leg1:
+            seats_1 = seats_1_of[order]
+            if not seats_1:
+                continue
+            ranges = tuple((bisect_left(departs, lo), bisect_left(departs, hi), extra)
+                           for lo, hi, extra in self._windows(arrive))
+            entry = self._candidate(leg2, (t1, start_1, arrive, order, seats_1), ranges)
+            if entry:
+                heap.append(entry)
+        heapq.heapify(heap)
+
+        plans = []
+        while heap and len(plans) < limit:
+            wait, _, _, idx, ranges, leg1 = heap[0]
+            pos, hi, extra = ranges[0]
+            plans.append((leg1[0], self._leg2[idx], wait, leg1[4], seats_2[pos]))
+            entry = self._candidate(leg2, leg1, ((pos + 1, hi, extra),) + ranges[1:])
+            if entry:
+                heapq.heapreplace(heap, entry)
+            else:
+                heapq.heappop(heap)
+        return plans
+
+    @staticmethod
+    def _candidate(leg2, leg1, ranges):
+        """
+        取第一程车次 leg1 的下一个候选第二程，组成堆条目；候选用尽返回 None
+        ranges 为剩余的候选区间 ((起, 止, 跨天补偿), ...)，下标指向有票的第二程序列
+        """
+        while ranges and ranges[0][0] >= ranges[0][1]:
+            ranges = ranges[1:]
+        if not ranges:
+            return None
+        departs, idxs, _ = leg2
+        _, start_1, arrive, order, _ = leg1
+        pos, _, extra = ranges[0]
+        return (departs[pos] + extra - arrive, start_1, order, idxs[pos], ranges, leg1)
+
+    @staticmethod
+    def _windows(arrive):
+        """
+        满足 >= MIN_TRANSFER_MINUTES 的第二程出发时间区间 [lo, hi) 及跨天补偿分钟，按等待时间先后排列
+        当天: [到达+40, 24:00)；跨天 (出发早于到达视为次日): [到达-24h+40, 到达)
+        """
+        return (
+            (arrive + MIN_TRANSFER_MINUTES, DAY_MINUTES, 0),
+            (max(0, arrive - DAY_MINUTES + MIN_TRANSFER_MINUTES), arrive, DAY_MINUTES),
+        )
+
+    def _seats_for(self, target_seats, filters):
+        key = (tuple(target_seats), tuple(f.key if f else None for f in filters))
+        cached = self._seat_cache.get(key)
+        if cached is None:
+            seats_1 = self._index_1.seat_lists(target_seats, filters[0])
+            seats_1_of = {order: seats_1[order] for _, _, _, order in self._leg1}
+            # 第二程只保留有票的车次 (仍按出发时间排序)：(出发分钟, 排序后下标, 余票列表)
+            seats_2 = self._index_2.seat_lists(target_seats, filters[1])
+            avail = [idx for idx, order in enumerate(self._leg2_orders) if seats_2[order]]
+            leg2 = ([self._departs[idx] for idx in avail], avail,
+                    [seats_2[self._leg2_orders[idx]] for idx in avail])
+            cached = self._seat_cache[key] = (seats_1_of, leg2)
+        return cached